@@ -1,9 +1,14 @@
+import asyncio
+import hashlib
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from urllib.request import urlopen
 
-from flask import _request_ctx_stack, request
+from flask import _request_ctx_stack, g, request
 from jose import jwt
 
 """
@@ -14,6 +19,13 @@ https://fsnd-kml.auth0.com/.well-known/jwks.json
 AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = [os.environ['ALGORITHMS']]
 API_AUDIENCE = os.environ['API_AUDIENCE']
+JWKS_URL = os.environ.get(
+    'JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_CACHE_TTL = float(os.environ.get('JWKS_CACHE_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = float(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = float(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
 
 # AuthError Exception
 '''
@@ -28,6 +40,119 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+# JWKS Key Store
+
+'''
+JWKSKeyStore
+    keeps the signing keys published at a JWKS url in memory
+
+    keys are served from memory for `ttl` seconds and refetched afterwards
+    a token with an unknown kid triggers an early refetch, at most once
+    every `min_refresh_interval` seconds
+    concurrent refreshes are collapsed into a single fetch
+    if a refresh fails, the keys fetched before keep being served
+
+    the source is the url of Auth0, of a local stand-in JWKS server or
+    a file:// url of a JWKS document, or a JWKS document held in memory
+    (a dict) or a function returning one, which never touch the network
+'''
+
+
+class JWKSKeyStore:
+    def __init__(self, source, ttl=JWKS_CACHE_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT, clock=time.monotonic):
+        self.source = source
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.fetch_count = 0
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        self.fetch_count += 1
+        if isinstance(self.source, dict):
+            return self.source
+        if callable(self.source):
+            return self.source()
+        with urlopen(self.source, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def configure(self, source):
+        '''
+        switches to another source, the keys of the previous one are dropped
+        '''
+        with self._lock:
+            self.source = source
+            self._keys = {}
+            self._fetched_at = None
+            self._attempted_at = None
+            self._generation += 1
+
+    def get_key(self, kid):
+        generation = self._generation
+        key = self._keys.get(kid)
+        if self._should_refresh(missing=key is None):
+            self.refresh(generation)
+            key = self._keys.get(kid)
+
+        if key is None and self._fetched_at is None:
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+        return key
+
+    def refresh(self, generation=None):
+        with self._lock:
+            # another thread refreshed while this one was waiting
+            if generation is not None and generation != self._generation:
+                return
+
+            try:
+                jwks = self.fetch()
+            except Exception:
+                return
+            finally:
+                self._generation += 1
+                self._attempted_at = self.clock()
+
+            self._keys = {
+                key['kid']: {
+                    'kty': key['kty'],
+                    'kid': key['kid'],
+                    'use': key['use'],
+                    'n': key['n'],
+                    'e': key['e']
+                }
+                for key in jwks['keys']
+            }
+            self._fetched_at = self._attempted_at
+
+    def needs_fetch(self, kid):
+        '''
+        whether get_key(kid) would fetch the JWKS, i.e. block on the network
+        '''
+        return self._should_refresh(missing=kid not in self._keys)
+
+    def _should_refresh(self, missing):
+        now = self.clock()
+        if self._attempted_at is not None and \
+                now - self._attempted_at < self.min_refresh_interval:
+            return False
+        if self._fetched_at is None or now - self._fetched_at >= self.ttl:
+            return True
+        return missing
+
+
+jwks_store = JWKSKeyStore(JWKS_URL)
+
+
 # Auth Header
 
 '''
@@ -41,7 +166,10 @@ class AuthError(Exception):
 
 
 def get_token_auth_header():
-    auth = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
+
+
+def parse_auth_header(auth):
     if not auth:
         raise AuthError({
             'code': 'authorization_header_missing',
@@ -106,7 +234,7 @@ def check_permissions(permission, payload):
         token: a json web token (string)
 
     it should be an Auth0 token with key id (kid)
-    it should verify the token using Auth0 /.well-known/jwks.json
+    it should verify the token using the keys cached by jwks_store
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -117,25 +245,14 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -173,6 +290,103 @@ def verify_decode_jwt(token):
     }, 400)
 
 
+'''
+verify_decode_jwt_async(token)
+    verify_decode_jwt for code running on an event loop
+    the JWKS is fetched in a worker thread when the keys are missing or
+    stale, otherwise the token is verified inline, it only costs CPU
+'''
+
+
+async def verify_decode_jwt_async(token):
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+    except Exception:
+        kid = None
+
+    if kid is not None and jwks_store.needs_fetch(kid):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, verify_decode_jwt, token)
+    return verify_decode_jwt(token)
+
+
+# Verified Token Cache
+
+'''
+VerifiedTokenCache
+    bounded LRU of payloads already verified by verify_decode_jwt
+
+    entries are keyed by the sha256 of the token, so raw tokens are
+    never kept in memory, and expire at the token's exp claim
+    tokens without an exp claim are not cached
+    hits and misses are counted for monitoring
+'''
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token, payload):
+        expires_at = payload.get('exp')
+        if self.maxsize <= 0 or not isinstance(expires_at, (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+token_cache = VerifiedTokenCache()
+
+
+'''
+use_jwks(source)
+    verifies tokens against the keys of another JWKS source (see
+    JWKSKeyStore), e.g. those of auth.testing.LocalIssuer in tests,
+    tokens verified with the previous keys are forgotten
+'''
+
+
+def use_jwks(source):
+    jwks_store.configure(source)
+    token_cache.clear()
+
+
 '''
 @TODO implement @requires_auth(permission) decorator method
     @INPUTS
@@ -180,6 +394,7 @@ def verify_decode_jwt(token):
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
+    unless the token is found in token_cache
     it should use the check_permissions method validate claims
     and check the requested permission
     return the decorator which passes the decoded payload
@@ -191,9 +406,36 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            start = time.perf_counter()
+            try:
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = verify_decode_jwt(token)
+                    token_cache.put(token, payload)
+                check_permissions(permission, payload)
+            finally:
+                # reported as the auth phase of the request
+                g.auth_duration = time.perf_counter() - start
+            # the client of the request, see flaskr.replicas
+            g.auth_payload = payload
             return f(payload, *args, **kwargs)
         return wrapper
     return requires_auth_decorator
+
+
+'''
+authenticate_async(auth, permission)
+    the checks of @requires_auth for the ASGI app, `auth` is the value of
+    the Authorization header, returns the payload or raises AuthError
+'''
+
+
+async def authenticate_async(auth, permission=''):
+    token = parse_auth_header(auth)
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = await verify_decode_jwt_async(token)
+        token_cache.put(token, payload)
+    check_permissions(permission, payload)
+    return payload
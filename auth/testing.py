@@ -0,0 +1,158 @@
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jose import jwt
+
+'''
+Local tokens for tests and benchmarks
+
+    LocalIssuer generates an RSA keypair and signs tokens like Auth0 does,
+    with any permissions and expiry, so the auth code runs unchanged with
+    no network access:
+
+        issuer = LocalIssuer()
+        use_jwks(issuer.jwks())  # or issuer.write_jwks(path), issuer.serve()
+        token = issuer.token(['view:autos'], expires_in=60)
+
+    the issuer and audience default to AUTH0_DOMAIN and API_AUDIENCE, the
+    ones auth.auth checks
+'''
+
+
+def generate_rsa_key():
+    '''
+    returns a new RSA private key as PEM and the modulus and exponent of
+    its public key
+    '''
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+    except ImportError:
+        # python-jose-cryptodome installs pycryptodome instead
+        from Crypto.PublicKey import RSA
+        key = RSA.generate(2048)
+        return key.exportKey().decode('ascii'), key.n, key.e
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption()).decode('ascii')
+    numbers = key.public_key().public_numbers()
+    return pem, numbers.n, numbers.e
+
+
+def base64url_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class LocalIssuer:
+
+    def __init__(self, domain=None, audience=None):
+        self.domain = domain or os.environ.get('AUTH0_DOMAIN', 'capstone.test')
+        self.audience = audience or os.environ.get('API_AUDIENCE', 'capstone')
+        self.kid = uuid.uuid4().hex
+        self.private_key, n, e = generate_rsa_key()
+        self._public_key = {
+            'kty': 'RSA',
+            'kid': self.kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': base64url_uint(n),
+            'e': base64url_uint(e)
+        }
+
+    def jwks(self):
+        return {'keys': [dict(self._public_key)]}
+
+    def token(self, permissions=(), expires_in=3600, **claims):
+        '''
+        a signed access token, a negative `expires_in` gives an expired one
+        claims override the defaults, e.g. aud='other' or sub='user'
+        '''
+        now = int(time.time())
+        payload = {
+            'iss': 'https://' + self.domain + '/',
+            'sub': 'local|' + uuid.uuid4().hex,
+            'aud': self.audience,
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions)
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.private_key, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+    def auth_header(self, permissions=(), **kwargs):
+        return 'Bearer ' + self.token(permissions, **kwargs)
+
+    def write_jwks(self, path):
+        '''
+        writes the JWKS to `path`, returns its file:// url for JWKS_URL
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.jwks(), f)
+        return 'file://' + os.path.abspath(path)
+
+    def serve(self):
+        return JWKSServer(self.jwks())
+
+
+class JWKSServer:
+    '''
+    serves a JWKS document at http://127.0.0.1:<port>/.well-known/jwks.json
+    from a background thread, until close()
+
+        with issuer.serve() as server:
+            use_jwks(server.url)
+    '''
+
+    def __init__(self, jwks, delay=0):
+        self.jwks = jwks
+        self.delay = delay
+        self.request_count = 0
+        self._server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), self._handler_class())
+        # a short poll interval keeps close() from blocking for long
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.01},
+            daemon=True)
+        self._thread.start()
+        self.url = 'http://127.0.0.1:%d/.well-known/jwks.json' % \
+            self._server.server_port
+
+    def _handler_class(self):
+        server = self
+
+        class JWKSHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.request_count += 1
+                # simulates a slow identity provider
+                time.sleep(server.delay)
+                body = json.dumps(server.jwks).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return JWKSHandler
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,146 @@
+"""
+JSON serialization benchmark
+
+Encodes a page of autos with their buyers, as GET /autos does, through
+flask.jsonify of Auto.format() dicts (the former path), through every
+available provider of flaskr.serialization, and from plain column tuples
+with the row serializers of flaskr.serializers, and prints the timings
+as JSON. No database needed.
+
+    python benchmarks/bench_json.py --autos 1000 --buyers-per-auto 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr.serialization import (OrjsonJSONProvider,  # noqa: E402
+                                  StdlibJSONProvider, json_list_response,
+                                  json_response)
+from flaskr.serializers import BUYER_COLUMNS, row_serializer  # noqa: E402
+from models import Auto, Buyer  # noqa: E402
+
+AUTO_COLUMNS = ('id', 'name', 'release_date')
+
+
+def make_autos(count, buyers_per_auto):
+    autos = []
+    for i in range(count):
+        auto = Auto(name='Auto %d' % i,
+                    release_date=datetime(2000, 1, 1) + timedelta(days=i))
+        auto.id = i + 1
+        for j in range(buyers_per_auto):
+            buyer = Buyer(name='Buyer %d-%d' % (i, j), age=20 + j,
+                          gender='FM'[j % 2], auto_id=auto.id)
+            buyer.id = i * buyers_per_auto + j + 1
+            auto.buyers.append(buyer)
+        autos.append(auto)
+    return autos
+
+
+def providers():
+    available = [StdlibJSONProvider()]
+    try:
+        available.append(OrjsonJSONProvider())
+    except ImportError:
+        pass
+    return available
+
+
+def paths(autos):
+    def flask_jsonify():
+        return jsonify({
+            'success': True,
+            'autos': [auto.format() for auto in autos],
+            'next_cursor': None
+        })
+    yield 'flask.jsonify', flask_jsonify
+
+    for provider in providers():
+        def materialized(provider=provider):
+            return json_response({
+                'success': True,
+                'autos': [auto.format() for auto in autos],
+                'next_cursor': None
+            }, provider=provider)
+
+        def streamed(provider=provider):
+            return json_list_response(
+                {'success': True, 'next_cursor': None}, 'autos', autos,
+                lambda auto: auto.format(), provider=provider)
+
+        yield provider.name + ' json_response', materialized
+        yield provider.name + ' json_list_response', streamed
+
+    # the tuples a Core select returns, read once outside of the timings
+    rows = [tuple(getattr(auto, column) for column in AUTO_COLUMNS)
+            for auto in autos]
+    buyer_rows = [tuple(getattr(buyer, column) for column in BUYER_COLUMNS)
+                  for auto in autos for buyer in auto.buyers]
+
+    for provider in providers():
+        def serialized(provider=provider):
+            serialize_buyer = row_serializer(BUYER_COLUMNS)
+            buyers = {row[0]: [] for row in rows}
+            for row in buyer_rows:
+                buyers[row[4]].append(serialize_buyer(row))
+            serialize = row_serializer(AUTO_COLUMNS)
+            return json_list_response(
+                {'success': True, 'next_cursor': None}, 'autos', rows,
+                lambda row: dict(serialize(row), buyers=buyers[row[0]]),
+                provider=provider)
+
+        yield provider.name + ' row_serializer', serialized
+
+
+def measure(encode, runs, warmup):
+    for _ in range(warmup):
+        encode()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        body = encode().get_data()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        'bytes': len(body)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--autos', type=int, default=1000)
+    parser.add_argument('--buyers-per-auto', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    args = parser.parse_args()
+
+    autos = make_autos(args.autos, args.buyers_per_auto)
+    app = Flask(__name__)
+    results = {}
+    with app.app_context():
+        for name, encode in paths(autos):
+            results[name] = measure(encode, args.runs, args.warmup)
+
+    baseline = results['flask.jsonify']['p50_ms']
+    for result in results.values():
+        result['speedup'] = round(baseline / max(result['p50_ms'], 1e-6), 2)
+    print(json.dumps({
+        'autos': args.autos,
+        'buyers_per_auto': args.buyers_per_auto,
+        'runs': args.runs,
+        'paths': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
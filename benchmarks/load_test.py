@@ -0,0 +1,182 @@
+"""
+Sync vs async load test
+
+Keeps `--concurrency` HTTP/1.1 keep-alive connections busy for `--duration`
+seconds against the sync deployment (gunicorn 'flaskr:create_app()') and
+the async one (uvicorn --factory flaskr.asgi:create_asgi_app), both started
+beforehand, and prints requests per second, p50/p95/p99 latencies and
+errors of each as JSON.
+
+    PORT=8000 gunicorn -c gunicorn.conf.py 'flaskr:create_app()'
+    uvicorn --factory --workers 4 --port 8001 flaskr.asgi:create_asgi_app
+    python benchmarks/load_test.py --token $TOKEN \\
+        --sync-url http://127.0.0.1:8000 --async-url http://127.0.0.1:8001
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = ('/autos', '/autos?limit=100', '/buyers', '/buyers?limit=100')
+
+
+async def read_response(reader):
+    '''
+    reads one response, returns its status code, headers and body
+    '''
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by the server')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            chunks.append(chunk[:-2])
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+    return status, headers, body
+
+
+class Connection:
+
+    def __init__(self, url, headers):
+        url = urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.headers = ''.join(
+            '%s: %s\r\n' % header for header in headers.items())
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port)
+        self.writer.write((
+            '%s %s HTTP/1.1\r\nHost: %s\r\nContent-Length: %d\r\n%s\r\n'
+            % (method, path, self.host, len(body), self.headers)
+        ).encode('latin-1') + body)
+        try:
+            status, headers, body = await read_response(self.reader)
+        except Exception:
+            self.close()
+            raise
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(timings, fraction):
+    if not timings:
+        return None
+    return round(timings[min(len(timings) - 1,
+                             int(len(timings) * fraction))], 3)
+
+
+def summarize(timings, errors, elapsed):
+    timings = sorted(timings)
+    return {
+        'ok': len(timings),
+        'errors': errors,
+        'rps': round(len(timings) / elapsed, 1),
+        'p50_ms': percentile(timings, 0.50),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99)
+    }
+
+
+async def run_load(url, requests, headers, concurrency, duration):
+    '''
+    sends the (name, make) `requests` in turn on `concurrency` connections
+    for `duration` seconds, make() returns the (method, path, body) of the
+    next request, returns the stats per request name and in total
+    '''
+    timings = {name: [] for name, _ in requests}
+    errors = {name: 0 for name, _ in requests}
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset):
+        connection = Connection(url, headers)
+        turn = offset
+        try:
+            while time.perf_counter() < deadline:
+                name, make = requests[turn % len(requests)]
+                turn += 1
+                start = time.perf_counter()
+                try:
+                    status, _ = await connection.request(*make())
+                except (OSError, ValueError, asyncio.IncompleteReadError):
+                    errors[name] += 1
+                    continue
+                if status >= 400:
+                    errors[name] += 1
+                else:
+                    timings[name].append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    return {
+        'total': summarize(
+            [timing for values in timings.values() for timing in values],
+            sum(errors.values()), elapsed),
+        'requests': {
+            name: summarize(timings[name], errors[name], elapsed)
+            for name, _ in requests}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sync-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--token', required=True,
+                        help='JWT with the view:autos and view:buyers '
+                             'permissions')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='GET path to request, repeatable')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=30)
+    args = parser.parse_args()
+
+    requests = [('GET ' + path, lambda path=path: ('GET', path, b''))
+                for path in args.paths or DEFAULT_PATHS]
+    headers = {'Authorization': 'Bearer ' + args.token,
+               'Accept-Encoding': 'identity'}
+    results = {}
+    for mode, url in (('sync', args.sync_url), ('async', args.async_url)):
+        results[mode] = asyncio.run(run_load(
+            url, requests, headers, args.concurrency, args.duration))
+
+    print(json.dumps({
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'modes': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,39 @@
 import os
 from datetime import datetime
 
-from flask import Flask, abort, jsonify, request
+from flask import Flask, Response, abort, request
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 
 from auth.auth import AuthError, requires_auth
-from models import Auto, Buyer, setup_db
+from flaskr.bulk import (BULK_MAX_ITEMS, ItemError, auto_changes,
+                         bulk_insert, buyer_changes, check_autos_exist,
+                         validate_auto, validate_buyer)
+from flaskr.caching import response_cache, row_cache
+from flaskr.compression import init_compression
+from flaskr.conditional import conditional
+from flaskr.detail import auto_detail, buyer_detail
+from flaskr.export import export_autos, export_buyers, ndjson_response
+from flaskr.fields import AUTO_FIELDS, AUTO_INCLUDES, get_fields, get_include
+from flaskr.filters import requested_ids
+from flaskr.instrumentation import init_instrumentation, timed
+from flaskr.listing import list_autos, list_buyers, run_sync
+from flaskr.replicas import replica_router
+from flaskr.serialization import json_response
+from models import (Auto, Buyer, delete_returning, pool_metrics, setup_db,
+                    unit_of_work, update_returning)
+
+
+def jsonify(*args, **kwargs):
+    '''
+    flask.jsonify through the configured JSON provider
+    '''
+    if args and kwargs:
+        raise TypeError(
+            "jsonify() behavior undefined when passed both args and kwargs")
+    with timed('serialize'):
+        return json_response(args[0] if len(args) == 1 else args or kwargs)
 
 
 def create_app(test_config=None):
@@ -16,6 +43,10 @@ def create_app(test_config=None):
     setup_db(app)
 
     CORS(app)
+    # after_request functions run in reverse order, so the instrumentation
+    # timings include compression
+    init_instrumentation(app)
+    init_compression(app)
 
     # CORS Headers
     @app.after_request
@@ -30,9 +61,15 @@ def create_app(test_config=None):
 
     '''
     GET /autos
-    Get all autos
+    Get autos ordered by id, one page at a time
+    Accepts `limit` (default 50) and the `after` cursor of the previous page
+    Filters: `release_date_min`, `release_date_max` and `name` (prefix)
+    Sort: `sort=name|release_date|id`, prefixed with `-` for descending
+    `fields=name,release_date` restricts the auto columns, buyers are
+    embedded without `fields` or with `include=buyers`
 
-    Example Request: curl 'http://localhost:5000/autos'
+    Example Request:
+    curl 'http://localhost:5000/autos?release_date_min=2012-01-01&sort=name'
 
     Expected Result:
     {
@@ -67,24 +104,27 @@ def create_app(test_config=None):
             },
             ...
         ],
+        "next_cursor": "eyJpZCI6MjB9",
         "success": true
     }
     '''
     @app.route('/autos', methods=['GET'])
     @requires_auth('view:autos')
+    @replica_router.reads
+    @conditional('autos', 'buyers')
+    @response_cache.cached('autos', 'buyers')
     def retrieve_autos(payload):
-        autos = Auto.query.all()
-        autos = list(map(lambda auto: auto.format(), autos))
-        return jsonify({
-            "success": True,
-            "autos": autos
-        })
+        return run_sync(list_autos())
 
     '''
     GET /buyers
-    Get all buyers
+    Get buyers ordered by id, one page at a time
+    Accepts `limit` (default 50) and the `after` cursor of the previous page
+    Filters: `gender`, `age_min`, `age_max`, `auto_id` and `name` (prefix)
+    Sort: `sort=name|age|auto_id|id`, prefixed with `-` for descending
 
-    Example Request: curl 'http://localhost:5000/buyers'
+    Example Request:
+    curl 'http://localhost:5000/buyers?limit=20&gender=F&age_min=30&sort=age'
 
     Expected Result:
     {
@@ -111,18 +151,108 @@ def create_app(test_config=None):
             "name": "Michael Brema"
             }
         ],
+        "next_cursor": null,
         "success": true
     }
     '''
     @app.route('/buyers', methods=['GET'])
     @requires_auth('view:buyers')
+    @replica_router.reads
+    @conditional('buyers')
+    @response_cache.cached('buyers')
     def retrieve_buyers(payload):
-        buyers = Buyer.query.all()
-        buyers = list(map(lambda buyer: buyer.format(), buyers))
-        return jsonify({
-            "success": True,
-            "buyers": buyers
-        })
+        return run_sync(list_buyers())
+
+    '''
+    GET /autos/export
+    Streams all autos as newline-delimited JSON, one auto per line
+    Buyers are embedded with `include=buyers`
+    `fields=name,release_date` restricts the auto columns
+
+    Example Request:
+    curl 'http://localhost:5000/autos/export?include=buyers'
+
+    Expected Result:
+    {"buyers": [...], "id": 1, "name": "Audi", "release_date": "..."}
+    {"buyers": [...], "id": 2, "name": "Pejot", "release_date": "..."}
+    ...
+    '''
+    @app.route('/autos/export', methods=['GET'])
+    @requires_auth('view:autos')
+    @conditional('autos', 'buyers')
+    def export_all_autos(payload):
+        fields = get_fields(AUTO_FIELDS)
+        include = get_include(AUTO_INCLUDES)
+        return ndjson_response(export_autos(
+            include_buyers='buyers' in include, fields=fields))
+
+    '''
+    GET /buyers/export
+    Streams all buyers as newline-delimited JSON, one buyer per line
+
+    Example Request: curl 'http://localhost:5000/buyers/export'
+
+    Expected Result:
+    {"age": 54, "auto_id": 2, "gender": "M", "id": 1, "name": "Tom Helge"}
+    ...
+    '''
+    @app.route('/buyers/export', methods=['GET'])
+    @requires_auth('view:buyers')
+    @conditional('buyers')
+    def export_all_buyers(payload):
+        return ndjson_response(export_buyers())
+
+    '''
+    GET /autos/<int:auto_id>
+    Get one auto, with its buyers unless `fields` or `include` says otherwise
+    `fields=name,release_date` restricts the auto columns
+    Batches of autos are read with GET /autos?ids=1,2,3
+
+    Example Request: curl 'http://localhost:5000/autos/2'
+
+    Expected Result:
+    {
+        "auto": {
+            "buyers": [...],
+            "id": 2,
+            "name": "Benz",
+            "release_date": "Fri, 04 May 2012 00:00:00 GMT"
+        },
+        "success": true
+    }
+    '''
+    @app.route('/autos/<int:auto_id>', methods=['GET'])
+    @requires_auth('view:autos')
+    @replica_router.reads
+    @conditional('autos', 'buyers')
+    def retrieve_auto(payload, auto_id):
+        return auto_detail(auto_id)
+
+    '''
+    GET /buyers/<int:buyer_id>
+    Get one buyer
+    Batches of buyers are read with GET /buyers?ids=1,2,3
+
+    Example Request: curl 'http://localhost:5000/buyers/1'
+
+    Expected Result:
+    {
+        "buyer": {
+            "age": 54,
+            "auto_id": 2,
+            "gender": "M",
+            "id": 1,
+            "name": "John Smidth"
+        },
+        "success": true
+    }
+    '''
+    @app.route('/buyers/<int:buyer_id>', methods=['GET'])
+    @requires_auth('view:buyers')
+    @replica_router.reads
+    @conditional('buyers')
+    def retrieve_buyer(payload, buyer_id):
+        return buyer_detail(buyer_id)
 
     '''
     POST /autos
@@ -150,14 +280,11 @@ def create_app(test_config=None):
         if body is None:
             abort(400)
 
-        title = body.get('title', None)
-        release_date = body.get('release_date', None)
-
-        if title is None or release_date is None:
-            abort(400, "Missing field for Auto")
-
-        auto = Auto(title=title,
-                      release_date=release_date)
+        try:
+            # the name is read from `title` or `name`, as in PATCH and bulk
+            auto = Auto(**validate_auto(body))
+        except ItemError as error:
+            abort(400, str(error))
 
         auto.insert()
 
@@ -203,14 +330,105 @@ def create_app(test_config=None):
         buyer = Buyer(name=name, age=age, gender=gender, auto_id=auto_id)
 
         buyer.insert()
+        # the auto embeds its buyers
+        row_cache.invalidate('autos', auto_id)
 
         return jsonify({
             "success": True
         })
 
+    def get_bulk_items():
+        body = request.get_json()
+
+        if not isinstance(body, list):
+            abort(400, "Expected an array of items")
+        if len(body) > BULK_MAX_ITEMS:
+            abort(400, "At most " + str(BULK_MAX_ITEMS) + " items per request")
+
+        return body
+
+    '''
+    POST /autos/bulk
+    Creates many autos at once, committed once per chunk
+    Invalid items are reported by their index and skipped
+
+    Example Request:
+    curl --location --request POST 'http://localhost:5000/autos/bulk' \
+        --header 'Content-Type: application/json' \
+        --data-raw '[
+            {"name": "Pek Yakında", "release_date": "2020-02-19"},
+            {"name": "Eyvah eyvah"}
+        ]'
+
+    Example Response:
+    {
+        "created": 1,
+        "errors": [
+            {
+            "index": 1,
+            "message": "Missing field for Auto"
+            }
+        ],
+        "success": true
+    }
+    '''
+    @app.route('/autos/bulk', methods=['POST'])
+    @requires_auth('post:autos')
+    def create_autos_bulk(payload):
+        created, errors = bulk_insert(Auto, get_bulk_items(), validate_auto)
+
+        return jsonify({
+            "success": True,
+            "created": created,
+            "errors": errors
+        })
+
+    '''
+    POST /buyers/bulk
+    Creates many buyers at once, committed once per chunk
+    Invalid items and buyers of unknown autos are reported by their index
+
+    Example Request:
+    curl --location --request POST 'http://localhost:5000/buyers/bulk' \
+        --header 'Content-Type: application/json' \
+        --data-raw '[
+            {"name": "Cem Yılmaz", "age": 45, "gender": "M", "auto_id": 2}
+        ]'
+
+    Example Response:
+    {
+        "created": 1,
+        "errors": [],
+        "success": true
+    }
+    '''
+    @app.route('/buyers/bulk', methods=['POST'])
+    @requires_auth('post:buyers')
+    def create_buyers_bulk(payload):
+        created, errors = bulk_insert(
+            Buyer, get_bulk_items(), validate_buyer, check=check_autos_exist)
+        if created:
+            row_cache.invalidate_table('autos')
+
+        return jsonify({
+            "success": True,
+            "created": created,
+            "errors": errors
+        })
+
+    def delete_autos_returning(ids):
+        try:
+            with unit_of_work():
+                return delete_returning(Auto, ids)
+        except IntegrityError:
+            # buyers.auto_id lacks the ON DELETE SET NULL of the migrations
+            abort(422, "Autos with buyers cannot be deleted")
+
     '''
     DELETE /autos/<int:auto_id>
     Deletes the auto with given id
+    One DELETE ... RETURNING id, the database sets the auto_id of its buyers
+    to null
 
     Example Request: curl --request DELETE 'http://localhost:5000/autos/1'
 
@@ -223,21 +441,54 @@ def create_app(test_config=None):
     @app.route('/autos/<int:auto_id>', methods=['DELETE'])
     @requires_auth('delete:autos')
     def delete_auto(payload, auto_id):
-        auto = Auto.query.filter(Auto.id == auto_id).one_or_none()
-
-        if auto is None:
+        if not delete_autos_returning([auto_id]):
             abort(404, "No auto with given id " + str(auto_id) + " is found")
 
-        auto.delete()
+        row_cache.invalidate('autos', auto_id)
+        # the buyers of the auto lost their auto_id
+        row_cache.invalidate_table('buyers')
 
         return jsonify({
             'success': True,
             'deleted': auto_id
         })
 
+    '''
+    DELETE /autos?ids=<id>,<id>,...
+    Deletes the autos with given ids in one DELETE ... RETURNING id
+    Ids without an auto are left out of "deleted"
+
+    Example Request:
+    curl --request DELETE 'http://localhost:5000/autos?ids=1,2,100'
+
+    Example Response:
+    {
+        "deleted": [1, 2],
+        "success": true
+    }
+    '''
+    @app.route('/autos', methods=['DELETE'])
+    @requires_auth('delete:autos')
+    def delete_autos(payload):
+        ids = requested_ids()
+
+        if ids is None:
+            abort(400, "ids is required")
+
+        deleted = sorted(row.id for row in delete_autos_returning(ids))
+        if deleted:
+            row_cache.invalidate('autos', *deleted)
+            row_cache.invalidate_table('buyers')
+
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        })
+
     '''
     DELETE /buyers/<int:buyer_id>
     Deletes the buyer with given id
+    One DELETE ... RETURNING id, auto_id
 
     Example Request: curl --request DELETE 'http://localhost:5000/buyers/1'
 
@@ -250,29 +501,42 @@ def create_app(test_config=None):
     @app.route('/buyers/<int:buyer_id>', methods=['DELETE'])
     @requires_auth('delete:buyers')
     def delete_buyer(payload, buyer_id):
-        buyer = Buyer.query.filter(Buyer.id == buyer_id).one_or_none()
+        with unit_of_work():
+            deleted = delete_returning(Buyer, [buyer_id], 'auto_id')
+            if not deleted:
+                abort(404, "No buyer with given id " + str(buyer_id) +
+                      " is found")
 
-        if buyer is None:
-            abort(404, "No buyer with given id " + str(buyer_id) + " is found")
-
-        buyer.delete()
+        row_cache.invalidate('buyers', buyer_id)
+        row_cache.invalidate('autos', deleted[0].auto_id)
 
         return jsonify({
             'success': True,
             'deleted': buyer_id
         })
 
+    def get_changes(validate):
+        body = request.get_json()
+        if body is None:
+            return {}
+        try:
+            return validate(body)
+        except ItemError as error:
+            abort(400, str(error))
+
     '''
     PATCH /autos/<auto_id>
         Updates the auto where <auto_id> is the existing auto id
         Responds with a 404 error if <auto_id> is not found
         Update the corresponding fields for Auto with id <auto_id>
+        Only the supplied fields are set, in one UPDATE ... RETURNING
+        whose row is the response, "title" is accepted for "name"
 
     Example Request:
     curl --location --request PATCH 'http://localhost:5000/autos/1' \
         --header 'Content-Type: application/json' \
         --data-raw '{
-            "title": "Eyvah eyvah 2"
+            "name": "Eyvah eyvah 2"
         }'
 
     Example Response:
@@ -280,39 +544,30 @@ def create_app(test_config=None):
         "success": true,
         "updated": {
             "id": 1,
-            "release_date": "Wed, 04 May 2016 00:00:00 GMT",
-            "title": "Eyvah eyvah 2"
+            "name": "Eyvah eyvah 2",
+            "release_date": "Wed, 04 May 2016 00:00:00 GMT"
         }
     }
     '''
     @app.route('/autos/<int:auto_id>', methods=['PATCH'])
     @requires_auth('update:autos')
     def update_auto(payload, auto_id):
+        changes = get_changes(auto_changes)
 
-        updated_auto = Auto.query.get(auto_id)
-
-        if not updated_auto:
-            abort(
-                404,
-                'Auto with id: ' +
-                str(auto_id) +
-                ' could not be found.')
-
-        body = request.get_json()
+        with unit_of_work():
+            updated = update_returning(Auto, auto_id, changes)
+            if updated is None:
+                abort(
+                    404,
+                    'Auto with id: ' +
+                    str(auto_id) +
+                    ' could not be found.')
 
-        title = body.get('title', None)
-        release_date = body.get('release_date', None)
-
-        if title:
-            updated_auto.title = title
-        if release_date:
-            updated_auto.release_date = release_date
-
-        updated_auto.update()
+        row_cache.invalidate('autos', auto_id)
 
         return jsonify({
             "success": True,
-            "updated": updated_auto.format()
+            "updated": dict(updated)
         })
 
     '''
@@ -320,6 +575,8 @@ def create_app(test_config=None):
         Updates the buyer where <buyer_id> is the existing buyer id
         Responds with a 404 error if <buyer_id> is not found
         Update the given fields for Buyer with id <buyer_id>
+        Only the supplied fields are set, in one UPDATE ... RETURNING
+        whose row is the response
 
     Example Request:
     curl --location --request PATCH 'http://localhost:5000/buyers/1' \
@@ -333,6 +590,7 @@ def create_app(test_config=None):
         "success": true,
         "updated": {
             "age": 54,
+            "auto_id": 2,
             "gender": "M",
             "id": 1,
             "name": "Tom Hanks"
@@ -342,45 +600,55 @@ def create_app(test_config=None):
     @app.route('/buyers/<int:buyer_id>', methods=['PATCH'])
     @requires_auth('update:buyers')
     def update_buyer(payload, buyer_id):
-
-        updated_buyer = Buyer.query.get(buyer_id)
-
-        if not updated_buyer:
-            abort(
-                404,
-                'Buyer with id: ' +
-                str(buyer_id) +
-                ' could not be found.')
-
-        body = request.get_json()
-
-        name = body.get('name', None)
-        age = body.get('age', None)
-        gender = body.get('gender', None)
-        auto_id = body.get('auto_id', None)
-
-        if name:
-            updated_buyer.name = name
-        if age:
-            updated_buyer.age = age
-        if gender:
-            updated_buyer.gender = gender
-        if auto_id:
-            updated_buyer.auto_id = auto_id
+        changes = get_changes(buyer_changes)
 
         try:
-            updated_buyer.update()
-        except BaseException:
+            with unit_of_work():
+                updated = update_returning(Buyer, buyer_id, changes)
+                if updated is None:
+                    abort(
+                        404,
+                        'Buyer with id: ' +
+                        str(buyer_id) +
+                        ' could not be found.')
+        except IntegrityError:
+            # already rolled back by the unit of work
             abort(
                 400,
                 "Bad formatted request due to nonexistent auto id" +
-                str(auto_id))
+                str(changes.get('auto_id')))
+
+        row_cache.invalidate('buyers', buyer_id)
+        if 'auto_id' in changes:
+            # the previous auto of the buyer is not returned by the update
+            row_cache.invalidate_table('autos')
+        else:
+            row_cache.invalidate('autos', updated['auto_id'])
 
         return jsonify({
             "success": True,
-            "updated": updated_buyer.format()
+            "updated": dict(updated)
         })
 
+    '''
+    GET /metrics
+    Connection pool health in the Prometheus text format
+
+    Example Request: curl 'http://localhost:5000/metrics'
+
+    Example Response:
+    db_pool_size{pool="primary"} 5
+    db_pool_checked_out{pool="primary"} 2
+    db_pool_overflow{pool="primary"} 0
+    db_pool_checkout_wait_seconds_count{pool="primary"} 1520
+    ...
+    '''
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(
+            pool_metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
+
     def get_error_message(error, default_message):
         try:
             return error.description
@@ -0,0 +1,416 @@
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import _app_ctx_stack, _request_ctx_stack, g, request
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import make_url
+
+from auth.auth import authenticate_async
+from flaskr import create_app
+from flaskr.caching import response_cache
+from flaskr.conditional import check_versions, set_validators
+from flaskr.listing import list_autos, list_buyers
+from models import TableVersion
+
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+ASYNC_DB_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', 1))
+ASYNC_DB_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', 20))
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))
+ASGI_STREAM_BUFFER = int(os.environ.get('ASGI_STREAM_BUFFER', 8))
+
+'''
+ASGI entry point
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+    GET /autos and GET /buyers are served on the event loop: the token is
+    verified with authenticate_async and the statements of flaskr.listing
+    are awaited on an asyncpg pool, so requests waiting on Postgres or on
+    the JWKS hold no thread and one process keeps thousands in flight
+
+    every other route is handed to the Flask app of create_app() on a
+    thread pool, streamed responses such as the exports keep streaming
+
+    the sync deployment, gunicorn 'flaskr:create_app()', is unchanged
+'''
+
+
+class AsyncpgDatabase:
+    '''
+    runs Core statements on an asyncpg pool
+    '''
+
+    def __init__(self, url, min_size=ASYNC_DB_POOL_MIN,
+                 max_size=ASYNC_DB_POOL_MAX):
+        url = make_url(url)
+        url.drivername = 'postgresql'
+        self.dsn = str(url)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self.dialect = postgresql.dialect()
+        # asyncpg sessions run with standard_conforming_strings on
+        self.dialect._backslash_escapes = False
+
+    async def connect(self):
+        # optional dependency, only needed by the ASGI entry point
+        import asyncpg
+        self.pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size)
+
+    async def close(self):
+        await self.pool.close()
+
+    def compile(self, statement):
+        '''
+        returns the SQL of `statement` with $1, $2, ... placeholders
+        and the list of its parameters
+        '''
+        compiled = statement.compile(dialect=self.dialect)
+        names = list(compiled.params)
+        placeholders = {
+            name: '$%d' % position
+            for position, name in enumerate(names, start=1)}
+        return compiled.string % placeholders, \
+            [compiled.params[name] for name in names]
+
+    async def fetch(self, statement):
+        sql, parameters = self.compile(statement)
+        async with self.pool.acquire() as connection:
+            return await connection.fetch(sql, *parameters)
+
+
+class ThreadedDatabase:
+    '''
+    runs Core statements on a SQLAlchemy engine in worker threads,
+    for databases without an async driver such as SQLite
+    '''
+
+    def __init__(self, url, threads=ASYNC_DB_POOL_MAX):
+        self.engine = create_engine(url)
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='database')
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+        self.engine.dispose()
+
+    def _fetch(self, statement):
+        with self.engine.connect() as connection:
+            return connection.execute(statement).fetchall()
+
+    async def fetch(self, statement):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._fetch, statement)
+
+
+def database_from_url(url):
+    if make_url(url).get_backend_name() == 'postgresql':
+        return AsyncpgDatabase(url)
+    return ThreadedDatabase(url)
+
+
+def environ_from_scope(scope, body):
+    '''
+    WSGI environ of an ASGI http scope
+    '''
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '')
+        .encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value \
+            if name in environ else value
+    return environ
+
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        body.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(body)
+
+
+def start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers]
+    }
+
+
+class RequestContext:
+    '''
+    a Flask request context that is only pushed while sync code of its
+    request runs, werkzeug keeps one context stack per thread and the
+    event loop thread interleaves many requests
+    '''
+
+    def __init__(self, app, environ):
+        self._context = app.request_context(environ)
+        self._app_context = None
+
+    def _attach(self):
+        _app_ctx_stack.push(self._app_context)
+        _request_ctx_stack.push(self._context)
+
+    @contextmanager
+    def active(self):
+        if self._app_context is None:
+            self._context.push()
+            self._app_context = _app_ctx_stack.top
+        else:
+            self._attach()
+        try:
+            yield
+        finally:
+            _request_ctx_stack.pop()
+            _app_ctx_stack.pop()
+
+    def close(self):
+        '''
+        pops the context for good, running the teardown functions
+        '''
+        if self._app_context is not None:
+            self._attach()
+            self._context.pop()
+
+
+class AsyncApp:
+
+    def __init__(self, flask_app, database, threads=ASGI_WSGI_THREADS):
+        self.flask_app = flask_app
+        self.database = database
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='wsgi')
+        # path: (list endpoint, permission, tables it reads)
+        self.routes = {
+            '/autos': (list_autos, 'view:autos', ('autos', 'buyers')),
+            '/buyers': (list_buyers, 'view:buyers', ('buyers',))
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await read_body(receive)
+            environ = environ_from_scope(scope, body)
+            route = self.routes.get(scope['path'])
+            if scope['method'] == 'GET' and route is not None:
+                await self.serve_native(environ, send, *route)
+            else:
+                await self.serve_wsgi(environ, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.database.connect()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def fetch(self, context, statement):
+        '''
+        awaits `statement` and counts it as a query of the request
+        '''
+        start = time.perf_counter()
+        rows = await self.database.fetch(statement)
+        elapsed = time.perf_counter() - start
+        with context.active():
+            g.db_queries = g.get('db_queries', 0) + 1
+            g.db_duration = g.get('db_duration', 0.0) + elapsed
+        return rows
+
+    async def run_steps(self, context, steps):
+        '''
+        flaskr.listing.run_sync for the event loop
+        '''
+        rows = None
+        while True:
+            with context.active():
+                try:
+                    statement = steps.send(rows)
+                except StopIteration as stop:
+                    return self.flask_app.make_response(stop.value)
+            rows = await self.fetch(context, statement)
+
+    async def dispatch(self, context, list_rows, permission, tables):
+        '''
+        the Flask view of a list endpoint with its decorators,
+        @requires_auth, @conditional and @response_cache.cached
+        '''
+        app = self.flask_app
+        with context.active():
+            response = app.preprocess_request()
+            authorization = request.headers.get('Authorization')
+        if response is not None:
+            return response
+
+        start = time.perf_counter()
+        try:
+            payload = await authenticate_async(authorization, permission)
+        finally:
+            with context.active():
+                g.auth_duration = time.perf_counter() - start
+
+        rows = await self.fetch(
+            context, TableVersion.select_current(*tables))
+        with context.active():
+            etag, last_modified, not_modified = check_versions(
+                TableVersion.versions_from_rows(tables, rows))
+            if not_modified:
+                return set_validators(
+                    app.make_response(('', 304)), etag, last_modified)
+            key = response_cache.make_key(tables, payload)
+            response = response_cache.lookup(key)
+
+        if response is None:
+            response = await self.run_steps(context, list_rows())
+            with context.active():
+                response = response_cache.store(key, response)
+        with context.active():
+            return set_validators(response, etag, last_modified)
+
+    def handle_error(self, error):
+        app = self.flask_app
+        try:
+            return app.make_response(app.handle_user_exception(error))
+        except Exception as unhandled:
+            return app.handle_exception(unhandled)
+
+    async def serve_native(self, environ, send, list_rows, permission,
+                           tables):
+        app = self.flask_app
+        context = RequestContext(app, environ)
+        try:
+            try:
+                response = await self.dispatch(
+                    context, list_rows, permission, tables)
+            except Exception as error:
+                with context.active():
+                    response = self.handle_error(error)
+
+            with context.active():
+                response = app.make_response(response)
+                response = app.process_response(response)
+                body, status, headers = response.get_wsgi_response(environ)
+                body = b''.join(body)
+            await send(start_message(status, headers))
+            await send({'type': 'http.response.body', 'body': body})
+        finally:
+            context.close()
+
+    async def serve_wsgi(self, environ, send):
+        '''
+        runs the Flask app in a worker thread, which iterates the whole
+        response so streamed responses keep their request context, and
+        relays its chunks through a bounded queue
+        '''
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=ASGI_STREAM_BUFFER)
+        cancelled = threading.Event()
+
+        def put(message):
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop) \
+                .result()
+
+        def run():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                started[:] = [status, headers]
+
+            def start():
+                if started:
+                    put(start_message(*started))
+                    del started[:]
+
+            try:
+                chunks = self.flask_app(environ, start_response)
+                try:
+                    for chunk in chunks:
+                        if cancelled.is_set():
+                            return
+                        start()
+                        if chunk:
+                            put({'type': 'http.response.body',
+                                 'body': chunk, 'more_body': True})
+                finally:
+                    if hasattr(chunks, 'close'):
+                        chunks.close()
+                start()
+                put({'type': 'http.response.body', 'body': b'',
+                     'more_body': False})
+            except Exception as error:
+                put(error)
+
+        task = loop.run_in_executor(self.executor, run)
+        try:
+            while True:
+                message = await queue.get()
+                if isinstance(message, Exception):
+                    raise message
+                await send(message)
+                if not message.get('more_body', True):
+                    break
+        finally:
+            cancelled.set()
+            # unblocks a producer waiting on a full queue
+            while not task.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0.001)
+
+
+def create_asgi_app(flask_app=None, database=None):
+    if flask_app is None:
+        flask_app = create_app()
+    if database is None:
+        database = database_from_url(
+            ASYNC_DATABASE_URL or
+            flask_app.config['SQLALCHEMY_DATABASE_URI'])
+    return AsyncApp(flask_app, database)
@@ -0,0 +1,185 @@
+import os
+from datetime import datetime
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Auto, db, mark_changed, unit_of_work
+
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 50000))
+
+'''
+Bulk inserts
+
+    items are validated one by one, valid ones are inserted with a single
+    executemany per chunk and committed once per chunk
+
+    invalid items and items the database rejected are reported as
+    {"index": <position in the request>, "message": <reason>} without
+    aborting the rest of the batch, a chunk the database rejects is
+    retried row by row to tell its bad items apart
+'''
+
+
+class ItemError(Exception):
+    pass
+
+
+def _parse_date(value):
+    if not isinstance(value, str):
+        raise ItemError("release_date must be a date string")
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ItemError("release_date must be formatted as YYYY-MM-DD")
+
+
+def _parse_str(value, field):
+    if not isinstance(value, str):
+        raise ItemError(field + " must be a string")
+    return value
+
+
+def _parse_int(value, field):
+    if isinstance(value, bool):
+        raise ItemError(field + " must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ItemError(field + " must be an integer")
+
+
+def validate_auto(item):
+    if not isinstance(item, dict):
+        raise ItemError("Auto must be an object")
+
+    name = item.get('name', item.get('title'))
+    release_date = item.get('release_date')
+    if name is None or release_date is None:
+        raise ItemError("Missing field for Auto")
+
+    return {
+        'name': _parse_str(name, 'name'),
+        'release_date': _parse_date(release_date)
+    }
+
+
+def validate_buyer(item):
+    if not isinstance(item, dict):
+        raise ItemError("Buyer must be an object")
+
+    name = item.get('name')
+    age = item.get('age')
+    gender = item.get('gender')
+    auto_id = item.get('auto_id')
+    if name is None or age is None or gender is None or auto_id is None:
+        raise ItemError("Missing field for Buyer")
+
+    return {
+        'name': _parse_str(name, 'name'),
+        'age': _parse_int(age, 'age'),
+        'gender': _parse_str(gender, 'gender'),
+        'auto_id': _parse_int(auto_id, 'auto_id')
+    }
+
+
+def auto_changes(item):
+    '''
+    the fields a PATCH supplied, validated like validate_auto
+    '''
+    if not isinstance(item, dict):
+        raise ItemError("Auto must be an object")
+
+    changes = {}
+    name = item.get('name', item.get('title'))
+    if name is not None:
+        changes['name'] = _parse_str(name, 'name')
+    if item.get('release_date') is not None:
+        changes['release_date'] = _parse_date(item['release_date'])
+    return changes
+
+
+def buyer_changes(item):
+    '''
+    the fields a PATCH supplied, validated like validate_buyer
+    '''
+    if not isinstance(item, dict):
+        raise ItemError("Buyer must be an object")
+
+    changes = {}
+    for field in ('name', 'gender'):
+        if item.get(field) is not None:
+            changes[field] = _parse_str(item[field], field)
+    for field in ('age', 'auto_id'):
+        if item.get(field) is not None:
+            changes[field] = _parse_int(item[field], field)
+    return changes
+
+
+def check_autos_exist(rows, errors):
+    '''
+    drops buyers of unknown autos, looked up with one IN query per chunk
+    '''
+    auto_ids = sorted({row['auto_id'] for _, row in rows})
+    found = set()
+    for start in range(0, len(auto_ids), BULK_CHUNK_SIZE):
+        chunk = auto_ids[start:start + BULK_CHUNK_SIZE]
+        found.update(auto_id for auto_id, in db.session.query(Auto.id)
+                     .filter(Auto.id.in_(chunk)))
+    valid = []
+    for index, row in rows:
+        if row['auto_id'] in found:
+            valid.append((index, row))
+        else:
+            errors.append({
+                'index': index,
+                'message': "No auto with given id " + str(row['auto_id'])
+            })
+    return valid
+
+
+def _insert(table, rows):
+    with unit_of_work() as session:
+        session.execute(table.insert(), rows)
+        mark_changed(table.name)
+
+
+def bulk_insert(model, items, validate, check=None,
+                chunk_size=BULK_CHUNK_SIZE):
+    '''
+    returns the number of inserted rows and the per-item errors
+    `check` may filter the validated rows against the database
+    '''
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            rows.append((index, validate(item)))
+        except ItemError as error:
+            errors.append({'index': index, 'message': str(error)})
+
+    if check is not None:
+        rows = check(rows, errors)
+
+    created = 0
+    table = model.__table__
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            _insert(table, [row for _, row in chunk])
+            created += len(chunk)
+        except SQLAlchemyError:
+            # the rows the database rejects are found one by one, so the
+            # valid items of the chunk are still inserted
+            for index, row in chunk:
+                try:
+                    _insert(table, [row])
+                    created += 1
+                except SQLAlchemyError:
+                    errors.append({
+                        'index': index,
+                        'message': "Could not insert " + model.__name__
+                    })
+
+    errors.sort(key=lambda error: error['index'])
+    return created, errors
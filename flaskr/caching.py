@@ -0,0 +1,279 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request
+
+from models import on_change
+
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', 'memory://')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+ROW_CACHE_URL = os.environ.get('ROW_CACHE_URL', RESPONSE_CACHE_URL)
+ROW_CACHE_SIZE = int(os.environ.get('ROW_CACHE_SIZE', 4096))
+ROW_CACHE_TTL = int(os.environ.get('ROW_CACHE_TTL', 0))
+
+'''
+Response cache
+
+    successful responses of read endpoints are cached per endpoint,
+    query string and permission set, so cached data never crosses roles
+
+    entries are tagged with the tables they were read from and
+    invalidate(*tables) drops all entries of a table at once, by bumping
+    a generation counter that is part of the key of its entries
+
+    the backend is an in-process LRU by default, or any Redis compatible
+    server with RESPONSE_CACHE_URL=redis://host:port/db
+'''
+
+
+class CacheBackend:
+    '''
+    interface of the storage used by ResponseCache
+    '''
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def incr(self, key, ttl=None):
+        '''
+        bumps the generation counter `key` to a value it never had, one
+        bumped with a ttl is dropped `ttl` seconds after its last bump
+        '''
+        raise NotImplementedError
+
+
+class LRUCacheBackend(CacheBackend):
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._counters = {}
+        # counters bumped with a ttl, by time of expiry
+        self._expiring = OrderedDict()
+        # every counter value is drawn from here, so a counter that expired
+        # never takes a value that keys of its previous life were built on
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            self._expire_counters()
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def incr(self, key, ttl=None):
+        with self._lock:
+            self._expire_counters()
+            self._counters[key] = next(self._sequence)
+            if ttl is not None:
+                self._expiring[key] = self.clock() + ttl
+                self._expiring.move_to_end(key)
+            return self._counters[key]
+
+    def _expire_counters(self):
+        now = self.clock()
+        while self._expiring:
+            key, expires_at = next(iter(self._expiring.items()))
+            if expires_at > now:
+                break
+            del self._expiring[key]
+            del self._counters[key]
+
+
+class RedisCacheBackend(CacheBackend):
+    '''
+    wraps a redis-py compatible client
+    '''
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        # optional dependency, only needed with a redis:// cache url
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is not None and key.startswith('generation:'):
+            return int(value)
+        return value
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def incr(self, key, ttl=None):
+        if ttl is None:
+            return self.client.incr(key)
+        # a counter that expired restarts from the time in microseconds,
+        # above every value of its previous life
+        pipeline = self.client.pipeline()
+        pipeline.set(key, int(time.time() * 1000000), nx=True, ex=ttl)
+        pipeline.incr(key)
+        pipeline.expire(key, ttl)
+        return pipeline.execute()[1]
+
+
+def backend_from_url(url, maxsize=RESPONSE_CACHE_SIZE):
+    if url.startswith('memory://'):
+        return LRUCacheBackend(maxsize)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCacheBackend.from_url(url)
+    raise ValueError('Unsupported response cache url: ' + url)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def invalidate(self, *tables):
+        for table in tables:
+            self.backend.incr('generation:' + table)
+
+    def make_key(self, tables, payload):
+        key = [
+            request.path,
+            sorted(request.args.items(multi=True)),
+            sorted(payload.get('permissions', [])),
+            [(table, self.backend.get('generation:' + table) or 0)
+             for table in tables],
+            # versions read by @conditional, so that the entries of a
+            # worker never outlive writes made through another worker
+            sorted(g.get('table_versions', {}).items())
+        ]
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return 'response:' + digest
+
+    def lookup(self, key):
+        '''
+        returns the cached response of `key`, or None
+        '''
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        mimetype, body = entry.split(b'\n', 1)
+        return current_app.response_class(
+            body, mimetype=mimetype.decode('ascii'))
+
+    def store(self, key, response):
+        if response.status_code == 200 and not response.is_streamed:
+            entry = response.mimetype.encode('ascii') + b'\n' + \
+                response.get_data()
+            self.backend.set(key, entry, self.ttl)
+        return response
+
+    def cached(self, *tables):
+        '''
+        @response_cache.cached('autos', 'buyers') decorates a GET handler
+        below @requires_auth, it receives the payload as first argument
+        '''
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(payload, *args, **kwargs):
+                key = self.make_key(tables, payload)
+                response = self.lookup(key)
+                if response is not None:
+                    return response
+                return self.store(key, current_app.make_response(
+                    f(payload, *args, **kwargs)))
+            return wrapper
+        return cached_decorator
+
+
+response_cache = ResponseCache(backend_from_url(RESPONSE_CACHE_URL))
+
+
+@on_change
+def invalidate_changed_tables(tables):
+    response_cache.invalidate(*tables)
+
+
+'''
+Row cache
+
+    the detail endpoints cache the encoded row of every id they serve,
+    invalidate(table, *ids) drops every variant (fields, include) of those
+    rows and invalidate_table(table) all rows of a table, by bumping the
+    generation counters that are part of the keys
+
+    disabled unless ROW_CACHE_TTL is set, with the in-process backend a
+    worker only sees the invalidations of the writes it served itself, so
+    several workers should share a Redis backend (ROW_CACHE_URL)
+'''
+
+
+class RowCache:
+    def __init__(self, backend, ttl=ROW_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def make_key(self, table, id, variant):
+        # apart from the generations of ResponseCache, which every write
+        # to the table bumps
+        table_generation = self.backend.get(
+            'generation:rows:' + table) or 0
+        row_generation = self.backend.get(
+            'generation:rows:%s:%d' % (table, id)) or 0
+        return 'row:%s:%d:%d:%d:%s' % (
+            table, table_generation, id, row_generation, variant)
+
+    def get(self, table, id, variant):
+        if not self.enabled:
+            return None
+        return self.backend.get(self.make_key(table, id, variant))
+
+    def set(self, table, id, variant, value):
+        if self.enabled:
+            self.backend.set(self.make_key(table, id, variant), value,
+                             self.ttl)
+
+    def invalidate(self, table, *ids):
+        if self.enabled:
+            for id in set(ids):
+                if id is not None:
+                    # the counter outlives the entries made before it
+                    # existed, and its values are never reused
+                    self.backend.incr(
+                        'generation:rows:%s:%d' % (table, int(id)),
+                        self.ttl)
+
+    def invalidate_table(self, table):
+        if self.enabled:
+            self.backend.incr('generation:rows:' + table)
+
+
+row_cache = RowCache(backend_from_url(ROW_CACHE_URL, ROW_CACHE_SIZE))
@@ -0,0 +1,128 @@
+import os
+import zlib
+
+from flask import request
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson',
+                      'text/plain')
+
+try:
+    # optional dependency, brotli is only offered when it is installed
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Response compression
+
+    JSON, NDJSON and text responses are compressed with brotli or gzip,
+    whichever the client prefers in Accept-Encoding (brotli wins ties)
+
+    buffered responses smaller than COMPRESS_MIN_SIZE bytes are sent as
+    they are, streamed responses are compressed chunk by chunk and every
+    chunk is flushed, so exports are never buffered
+'''
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level=COMPRESS_LEVEL):
+        # wbits 16 + MAX_WBITS writes the gzip header and trailer
+        self._compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality=COMPRESS_BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def available_encoders():
+    encoders = {'gzip': GzipEncoder}
+    if brotli is not None:
+        encoders['br'] = BrotliEncoder
+    return encoders
+
+
+def negotiate_encoder():
+    '''
+    returns the encoder class preferred by the client, or None
+    '''
+    encoders = available_encoders()
+    # best_match honours q-values and skips encodings refused with q=0
+    name = request.accept_encodings.best_match(
+        [name for name in ('br', 'gzip') if name in encoders])
+    return encoders.get(name)
+
+
+def compress_chunks(chunks, encoder):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = encoder.compress(chunk) + encoder.flush()
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        # closes the wrapped stream, e.g. its request context
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response, min_size=COMPRESS_MIN_SIZE):
+    if response.status_code != 200 or \
+            response.mimetype not in COMPRESS_MIMETYPES or \
+            'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoder_class = negotiate_encoder()
+    if encoder_class is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(
+            response.response, encoder_class())
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        encoder = encoder_class()
+        response.set_data(encoder.compress(data) + encoder.finish())
+
+    response.headers['Content-Encoding'] = encoder_class.name
+    # the compressed bytes differ from the identity representation
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
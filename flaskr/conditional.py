@@ -0,0 +1,80 @@
+import hashlib
+from functools import wraps
+
+from flask import g, make_response, request
+
+from models import TableVersion
+
+'''
+Conditional GET
+
+    responses of read endpoints carry an ETag and a Last-Modified header
+    derived from the versions of the tables they read, not from the rows
+    a matching If-None-Match or If-Modified-Since is answered with
+    304 Not Modified before the handler runs, so no row is loaded
+'''
+
+
+def make_etag(versions):
+    key = [request.path, sorted(request.args.items(multi=True))]
+    key.extend((name, versions[name][0]) for name in sorted(versions))
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def last_modified_of(versions):
+    changes = [updated_at for _, updated_at in versions.values()
+               if updated_at is not None]
+    if not changes:
+        return None
+    # HTTP dates have a resolution of one second
+    return max(changes).replace(microsecond=0)
+
+
+def is_not_modified(etag, last_modified):
+    if request.if_none_match:
+        # weak comparison, compressed responses carry a weak ETag
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def check_versions(versions):
+    '''
+    returns the ETag and Last-Modified of `versions`, as read by
+    TableVersion.current, and whether the client copy is still fresh
+    '''
+    g.table_versions = {
+        name: version for name, (version, _) in versions.items()}
+    etag = make_etag(versions)
+    last_modified = last_modified_of(versions)
+    return etag, last_modified, is_not_modified(etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional(*tables):
+    '''
+    @conditional('autos', 'buyers') decorates a GET handler
+    whose response depends only on the given tables and the query string
+    '''
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag, last_modified, not_modified = check_versions(
+                TableVersion.current(*tables))
+
+            if not_modified:
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            return set_validators(response, etag, last_modified)
+        return wrapper
+    return conditional_decorator
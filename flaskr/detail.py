@@ -0,0 +1,63 @@
+from flask import abort
+from sqlalchemy.orm import selectinload
+
+from flaskr.caching import row_cache
+from flaskr.fields import (AUTO_FIELDS, AUTO_INCLUDES, get_fields,
+                           get_include, load_fields)
+from flaskr.instrumentation import timed
+from flaskr.serialization import json_dumps, json_encoded_response
+from models import Auto, Buyer
+
+'''
+Detail endpoints
+
+    GET /autos/<id> and GET /buyers/<id> load the row with Query.get, so an
+    entity already in the identity map of the session is not read again,
+    and keep the encoded row in the row cache of flaskr.caching until a
+    write to that row invalidates it
+
+    batches are read through the list endpoints, e.g. GET /autos?ids=1,2,3
+'''
+
+
+def _detail_response(table, key, id, variant, load):
+    encoded = row_cache.get(table, id, variant)
+    if encoded is None:
+        row = load()
+        if row is None:
+            abort(404, "No " + key + " with given id " + str(id) +
+                  " is found")
+        with timed('serialize'):
+            encoded = json_dumps(row)
+        row_cache.set(table, id, variant, encoded)
+    return json_encoded_response({"success": True}, key, encoded)
+
+
+def auto_detail(auto_id):
+    fields = get_fields(AUTO_FIELDS)
+    include = get_include(
+        AUTO_INCLUDES, default=AUTO_INCLUDES if fields is None else ())
+    include_buyers = 'buyers' in include
+    variant = ','.join(fields or AUTO_FIELDS) + \
+        ('+buyers' if include_buyers else '')
+
+    def load():
+        query = Auto.query
+        if fields is not None:
+            query = query.options(load_fields(Auto, fields))
+        if include_buyers:
+            query = query.options(selectinload(Auto.buyers))
+        auto = query.get(auto_id)
+        if auto is None:
+            return None
+        return auto.format(include_buyers=include_buyers, fields=fields)
+
+    return _detail_response('autos', 'auto', auto_id, variant, load)
+
+
+def buyer_detail(buyer_id):
+    def load():
+        buyer = Buyer.query.get(buyer_id)
+        return None if buyer is None else buyer.format()
+
+    return _detail_response('buyers', 'buyer', buyer_id, 'all', load)
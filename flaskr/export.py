@@ -0,0 +1,71 @@
+import os
+
+from flask import Response, stream_with_context
+from sqlalchemy.orm.attributes import set_committed_value
+
+from flaskr.fields import load_fields
+from flaskr.serialization import json_provider
+from models import Auto, Buyer
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+'''
+NDJSON export
+
+    rows are read through a server-side cursor (`yield_per`) and written
+    one JSON document per line as they arrive, so memory stays bounded by
+    the batch size whatever the size of the table
+'''
+
+
+def ndjson_response(rows):
+    return Response(stream_with_context(rows),
+                    mimetype='application/x-ndjson')
+
+
+def _to_lines(batch, format_row):
+    dumps = json_provider.dumps
+    return b''.join(dumps(format_row(row)) + b'\n' for row in batch)
+
+
+def _batches(query, batch_size):
+    batch = []
+    for row in query.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _attach_buyers(autos):
+    '''
+    loads the buyers of a batch of autos with one IN query
+    '''
+    buyers_by_auto = {auto.id: [] for auto in autos}
+    buyers = Buyer.query \
+        .filter(Buyer.auto_id.in_(list(buyers_by_auto))) \
+        .order_by(Buyer.id)
+    for buyer in buyers:
+        buyers_by_auto[buyer.auto_id].append(buyer)
+    for auto in autos:
+        set_committed_value(auto, 'buyers', buyers_by_auto[auto.id])
+
+
+def export_autos(include_buyers=False, fields=None,
+                 batch_size=EXPORT_BATCH_SIZE):
+    query = Auto.query.order_by(Auto.id)
+    if fields is not None:
+        query = query.options(load_fields(Auto, fields))
+    for batch in _batches(query, batch_size):
+        if include_buyers:
+            _attach_buyers(batch)
+        yield _to_lines(batch, lambda auto: auto.format(
+            include_buyers=include_buyers, fields=fields))
+
+
+def export_buyers(batch_size=EXPORT_BATCH_SIZE):
+    query = Buyer.query.order_by(Buyer.id)
+    for batch in _batches(query, batch_size):
+        yield _to_lines(batch, lambda buyer: buyer.format())
@@ -0,0 +1,52 @@
+from flask import abort, request
+from sqlalchemy.orm import load_only
+
+AUTO_FIELDS = ('id', 'name', 'release_date')
+AUTO_INCLUDES = ('buyers',)
+
+'''
+Sparse fieldsets
+
+    `fields=name,release_date` restricts the columns that are SELECTed
+    and returned, the id is always part of the response
+
+    `include=buyers` embeds the related buyers, without it the
+    relationship is never loaded
+'''
+
+
+def _list_arg(name, allowed):
+    values = [value.strip() for value in request.args[name].split(',')
+              if value.strip()]
+    if any(value not in allowed for value in values):
+        abort(400, name + " must be a comma separated list of " +
+              ', '.join(allowed))
+    return values
+
+
+def get_fields(allowed):
+    '''
+    returns the requested fields in the order of `allowed`, or None
+    '''
+    if 'fields' not in request.args:
+        return None
+    fields = _list_arg('fields', allowed)
+    if not fields:
+        abort(400, "fields must not be empty")
+    return [field for field in allowed if field == 'id' or field in fields]
+
+
+def get_include(allowed, default=()):
+    if 'include' not in request.args:
+        return set(default)
+    return set(_list_arg('include', allowed))
+
+
+def load_fields(model, fields, *extra):
+    '''
+    query option loading only the given columns, the primary key is
+    always loaded
+    '''
+    columns = list(fields)
+    columns.extend(column for column in extra if column not in fields)
+    return load_only(*[getattr(model, column) for column in columns])
@@ -0,0 +1,133 @@
+import os
+from datetime import datetime
+
+from flask import abort, request
+
+from models import Auto, Buyer
+
+AUTO_SORT_KEYS = ('id', 'name', 'release_date')
+BUYER_SORT_KEYS = ('id', 'name', 'age', 'auto_id')
+MAX_IDS = int(os.environ.get('MAX_IDS', 1000))
+
+'''
+Filtering
+
+    query parameters are validated and compiled to SQL predicates on
+    indexed columns, invalid values are answered with 400 Bad Request
+
+    autos: `release_date_min`, `release_date_max` (YYYY-MM-DD, inclusive)
+           and `name` (prefix)
+    buyers: `gender`, `age_min`, `age_max` (inclusive), `auto_id`
+            and `name` (prefix)
+    both: `ids=1,2,3`, batches of up to MAX_IDS ids read with one IN query
+'''
+
+
+def _int_arg(name, minimum=None):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400, name + " must be an integer")
+    if minimum is not None and value < minimum:
+        abort(400, name + " must be at least " + str(minimum))
+    return value
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, name + " must be formatted as YYYY-MM-DD")
+
+
+def _prefix_arg(name):
+    '''
+    returns a LIKE pattern matching values that start with the argument
+    '''
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value:
+        abort(400, name + " must not be empty")
+    escaped = value.replace('\\', '\\\\') \
+        .replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+def _ids_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        ids = sorted({int(id) for id in value.split(',') if id.strip()})
+    except ValueError:
+        abort(400, name + " must be a comma separated list of integers")
+    if not ids:
+        abort(400, name + " must not be empty")
+    if len(ids) > MAX_IDS:
+        abort(400, "At most " + str(MAX_IDS) + " " + name)
+    return ids
+
+
+def requested_ids():
+    '''
+    the ids of `ids=1,2,3`, None when the argument is missing
+    '''
+    return _ids_arg('ids')
+
+
+def _range(column, name, minimum, maximum):
+    predicates = []
+    if minimum is not None:
+        predicates.append(column >= minimum)
+    if maximum is not None:
+        predicates.append(column <= maximum)
+    if minimum is not None and maximum is not None and minimum > maximum:
+        abort(400, name + "_min must not be greater than " + name + "_max")
+    return predicates
+
+
+def auto_filters():
+    predicates = _range(Auto.release_date, 'release_date',
+                        _date_arg('release_date_min'),
+                        _date_arg('release_date_max'))
+
+    ids = _ids_arg('ids')
+    if ids is not None:
+        predicates.append(Auto.id.in_(ids))
+
+    name = _prefix_arg('name')
+    if name is not None:
+        predicates.append(Auto.name.like(name, escape='\\'))
+    return predicates
+
+
+def buyer_filters():
+    predicates = _range(Buyer.age, 'age',
+                        _int_arg('age_min', minimum=0),
+                        _int_arg('age_max', minimum=0))
+
+    ids = _ids_arg('ids')
+    if ids is not None:
+        predicates.append(Buyer.id.in_(ids))
+
+    gender = request.args.get('gender')
+    if gender is not None:
+        if not gender:
+            abort(400, "gender must not be empty")
+        predicates.append(Buyer.gender == gender)
+
+    auto_id = _int_arg('auto_id')
+    if auto_id is not None:
+        predicates.append(Buyer.auto_id == auto_id)
+
+    name = _prefix_arg('name')
+    if name is not None:
+        predicates.append(Buyer.name.like(name, escape='\\'))
+    return predicates
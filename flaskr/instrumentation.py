@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+request_logger = logging.getLogger('flaskr.requests')
+slow_query_logger = logging.getLogger('flaskr.sql')
+
+'''
+Request instrumentation
+
+    every statement sent through any engine is counted and timed, and the
+    totals of a request are reported with its auth and serialize phases
+    as a Server-Timing header and as one structured log record
+    statements slower than SLOW_QUERY_MS are logged with their parameters
+'''
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_duration = g.get('db_duration', 0.0) + elapsed
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            'slow query (%.1f ms): %s; parameters: %r',
+            elapsed * 1000, statement, parameters,
+            extra={
+                'duration_ms': round(elapsed * 1000, 3),
+                'statement': statement,
+                'parameters': parameters
+            })
+
+
+@contextmanager
+def timed(phase):
+    '''
+    adds the time spent in the block to the phase of the current request
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        attribute = phase + '_duration'
+        setattr(g, attribute,
+                g.get(attribute, 0.0) + time.perf_counter() - start)
+
+
+def server_timing(fields):
+    return ', '.join([
+        'auth;dur=%.2f' % fields['auth_ms'],
+        'db;dur=%.2f;desc="%d queries"' % (
+            fields['db_ms'], fields['db_queries']),
+        'serialize;dur=%.2f' % fields['serialize_ms'],
+        'total;dur=%.2f' % fields['duration_ms']
+    ])
+
+
+def init_instrumentation(app):
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def report_request(response):
+        if 'request_start' not in g:
+            return response
+
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms':
+                (time.perf_counter() - g.request_start) * 1000,
+            'auth_ms': g.get('auth_duration', 0.0) * 1000,
+            'db_ms': g.get('db_duration', 0.0) * 1000,
+            'db_queries': g.get('db_queries', 0),
+            'serialize_ms': g.get('serialize_duration', 0.0) * 1000
+        }
+        for key, value in fields.items():
+            if key.endswith('_ms'):
+                fields[key] = round(value, 3)
+
+        response.headers['Server-Timing'] = server_timing(fields)
+        request_logger.info(json.dumps(fields), extra=fields)
+        return response
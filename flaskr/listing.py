@@ -0,0 +1,78 @@
+from flaskr.fields import AUTO_FIELDS, AUTO_INCLUDES, get_fields, get_include
+from flaskr.filters import (AUTO_SORT_KEYS, BUYER_SORT_KEYS, auto_filters,
+                            buyer_filters)
+from flaskr.instrumentation import timed
+from flaskr.pagination import get_page_args, page_of, page_query
+from flaskr.serialization import json_list_response
+from flaskr.serializers import (BUYER_COLUMNS, add_buyers, row_serializer,
+                                select_buyers, select_columns)
+from models import Auto, Buyer, db
+
+'''
+List endpoints
+
+    GET /autos and GET /buyers are generators that yield the Core
+    statements they need, are sent back the rows and return the response,
+    so the same code serves the Flask views, through run_sync, and the
+    ASGI app of flaskr.asgi, which awaits the statements on an async driver
+'''
+
+
+def run_sync(steps):
+    '''
+    runs the statements of `steps` on db.session, returns its response
+    '''
+    try:
+        statement = next(steps)
+        while True:
+            statement = steps.send(db.session.execute(statement).fetchall())
+    except StopIteration as stop:
+        return stop.value
+
+
+def list_autos():
+    limit, position, sort = get_page_args(Auto, AUTO_SORT_KEYS)
+    fields = get_fields(AUTO_FIELDS)
+    # full autos embed their buyers unless `include` says otherwise
+    include = get_include(
+        AUTO_INCLUDES, default=AUTO_INCLUDES if fields is None else ())
+
+    # plain column tuples, the sort column is also read for the cursor
+    columns = fields or AUTO_FIELDS
+    query = select_columns(Auto, columns, extra=[sort.lstrip('-')],
+                           where=auto_filters())
+    rows = yield page_query(query, Auto, limit, position, sort)
+    autos, next_cursor = page_of(rows, Auto, limit, sort)
+
+    buyers = None
+    if 'buyers' in include:
+        buyers = {auto['id']: [] for auto in autos}
+        if buyers:
+            # buyers of the page are loaded with one extra IN query
+            add_buyers(buyers, (yield select_buyers(list(buyers))))
+
+    serialize = row_serializer(columns)
+
+    def format_auto(auto):
+        if buyers is None:
+            return serialize(auto)
+        return dict(serialize(auto), buyers=buyers[auto['id']])
+
+    with timed('serialize'):
+        return json_list_response({
+            "success": True,
+            "next_cursor": next_cursor
+        }, "autos", autos, format_auto)
+
+
+def list_buyers():
+    limit, position, sort = get_page_args(Buyer, BUYER_SORT_KEYS)
+    query = select_columns(Buyer, BUYER_COLUMNS, where=buyer_filters())
+    rows = yield page_query(query, Buyer, limit, position, sort)
+    buyers, next_cursor = page_of(rows, Buyer, limit, sort)
+
+    with timed('serialize'):
+        return json_list_response({
+            "success": True,
+            "next_cursor": next_cursor
+        }, "buyers", buyers, row_serializer(BUYER_COLUMNS))
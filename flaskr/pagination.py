@@ -0,0 +1,184 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import DateTime, and_, or_, select, tuple_, union_all
+
+from models import db
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+
+'''
+Keyset (cursor) pagination
+
+    pages are read with `WHERE id > <last id> ORDER BY id LIMIT <limit>`
+    so every page costs one index range scan, however deep it is
+
+    clients pass `limit` and `after` query parameters and follow the
+    `next_cursor` of the response, which is null on the last page
+
+    `sort=<column>` or `sort=-<column>` (descending) orders the rows by
+    (column, id) and the cursor carries the column value of the last row,
+    so pages are read from the matching (column, id) index
+    nulls sort after every value, as in a Postgres index
+'''
+
+
+def encode_cursor(position):
+    data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padding = '=' * (-len(cursor) % 4)
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except ValueError:
+        abort(400, "Invalid cursor")
+    if not isinstance(position, dict) or \
+            not isinstance(position.get('id'), int):
+        abort(400, "Invalid cursor")
+    return position
+
+
+def _sort_column(model, sort):
+    descending = sort.startswith('-')
+    return getattr(model, sort.lstrip('-')), descending
+
+
+def _cursor_value(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    elif isinstance(value, column.type.python_type) and \
+            not isinstance(value, bool):
+        return value
+    abort(400, "Invalid cursor")
+
+
+def get_page_args(model, sort_keys=('id',)):
+    '''
+    reads `limit`, `after` and `sort` from the query string
+    '''
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        abort(400, "limit must be between 1 and " + str(MAX_PAGE_SIZE))
+
+    sort = request.args.get('sort', 'id')
+    if sort.lstrip('-') not in sort_keys or sort.startswith('--'):
+        abort(400, "sort must be one of " + ', '.join(sort_keys) +
+              ", optionally prefixed with -")
+
+    after = request.args.get('after')
+    position = decode_cursor(after) if after else None
+    if position is not None:
+        if position.get('sort', 'id') != sort:
+            abort(400, "Cursor does not match sort")
+        column, _ = _sort_column(model, sort)
+        if column.key != 'id':
+            if 'value' not in position:
+                abort(400, "Invalid cursor")
+            position['value'] = _cursor_value(column, position['value'])
+    return limit, position, sort
+
+
+def _after(column, id_column, value, last_id, descending):
+    '''
+    rows following (value, last_id) in (column, id) order, nulls last
+    '''
+    if value is None:
+        if descending:
+            return or_(column.isnot(None),
+                       and_(column.is_(None), id_column < last_id))
+        return and_(column.is_(None), id_column > last_id)
+    if descending:
+        return tuple_(column, id_column) < (value, last_id)
+    # the nulls that follow are read by _ascending_page
+    return tuple_(column, id_column) > (value, last_id)
+
+
+def _ascending_page(query, column, id_column, value, last_id, limit):
+    '''
+    the page after a non-null (value, last_id) in ascending order: the rest
+    of the (column, id) range, then the nulls by id, each read as a range
+    scan of the index and limited apart, as an OR of the two is not
+    '''
+    ranged = query.where(_after(column, id_column, value, last_id, False)) \
+        .order_by(column, id_column).limit(limit)
+    nulls = query.where(column.is_(None)).order_by(id_column).limit(limit)
+    page = union_all(select([ranged.alias()]),
+                     select([nulls.alias()])).alias('page')
+    return select([page]).order_by(
+        page.c[column.key].asc().nullslast(), page.c[id_column.key]) \
+        .limit(limit)
+
+
+def _position_of(row, column, sort):
+    position = {'id': row['id']}
+    if sort != 'id':
+        position['sort'] = sort
+    if column.key != 'id':
+        value = row[column.key]
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        position['value'] = value
+    return position
+
+
+def page_query(query, model, limit, position=None, sort='id'):
+    '''
+    returns the Core select of the page of `query` following `position`,
+    `query` selects columns of `model` including its sort column
+    '''
+    column, descending = _sort_column(model, sort)
+    if column is model.id:
+        query = query.order_by(model.id.desc() if descending else model.id)
+        if position is not None:
+            query = query.where(model.id < position['id'] if descending
+                                else model.id > position['id'])
+    else:
+        value = None if position is None else position.get('value')
+        if position is not None and value is not None and not descending:
+            return _ascending_page(query, column, model.id, value,
+                                   position['id'], limit + 1)
+        if descending:
+            query = query.order_by(column.desc().nullsfirst(),
+                                   model.id.desc())
+        else:
+            query = query.order_by(column.asc().nullslast(), model.id)
+        if position is not None:
+            query = query.where(_after(
+                column, model.id, position.get('value'), position['id'],
+                descending))
+
+    # one extra row tells whether there is a next page
+    return query.limit(limit + 1)
+
+
+def page_of(rows, model, limit, sort='id'):
+    '''
+    returns the rows of the page read with page_query
+    and the cursor of the next page
+    '''
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    column, _ = _sort_column(model, sort)
+    return rows, encode_cursor(_position_of(rows[-1], column, sort))
+
+
+def paginate(query, model, limit, position=None, sort='id'):
+    rows = db.session.execute(
+        page_query(query, model, limit, position, sort)).fetchall()
+    return page_of(rows, model, limit, sort)
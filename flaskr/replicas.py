@@ -0,0 +1,91 @@
+import itertools
+import os
+from functools import wraps
+
+from flask import current_app, g, has_request_context
+
+from flaskr.caching import RESPONSE_CACHE_URL, backend_from_url
+from models import REPLICA_BIND_PREFIX, db, on_change
+
+REPLICA_STICKY_URL = os.environ.get('REPLICA_STICKY_URL', RESPONSE_CACHE_URL)
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+'''
+Read replicas
+
+    with DATABASE_REPLICA_URLS=postgresql://replica-1/capstone,... the GET
+    handlers decorated with @replica_router.reads run their statements on
+    the replicas in turn, everything else stays on the primary
+
+    a client that wrote reads from the primary for REPLICA_STICKY_SECONDS
+    after its commit, so it sees its own writes however far the replicas
+    lag; clients are told apart by the `sub` claim of their token and the
+    window is kept in the cache backend of REPLICA_STICKY_URL, several
+    workers should share a Redis backend
+'''
+
+
+class ReplicaRouter:
+    def __init__(self, backend, sticky_seconds=REPLICA_STICKY_SECONDS):
+        self.backend = backend
+        self.sticky_seconds = sticky_seconds
+        self._turns = itertools.count()
+
+    def replicas(self):
+        binds = current_app.config.get('SQLALCHEMY_BINDS') or {}
+        return sorted(name for name in binds
+                      if name.startswith(REPLICA_BIND_PREFIX))
+
+    def sticky_key(self, payload):
+        subject = payload.get('sub')
+        return None if subject is None else 'sticky:' + subject
+
+    def record_write(self, payload):
+        key = self.sticky_key(payload)
+        if key is not None and self.sticky_seconds > 0:
+            self.backend.set(key, b'1', self.sticky_seconds)
+
+    def is_sticky(self, payload):
+        key = self.sticky_key(payload)
+        return key is not None and self.sticky_seconds > 0 and \
+            self.backend.get(key) is not None
+
+    def choose(self, payload):
+        '''
+        the replica bind of the next read of this client, None for the
+        primary
+        '''
+        replicas = self.replicas()
+        if not replicas or self.is_sticky(payload):
+            return None
+        return replicas[next(self._turns) % len(replicas)]
+
+    def reads(self, f):
+        '''
+        @replica_router.reads decorates a GET handler below @requires_auth,
+        above @conditional so the versions come from the same database
+        the handler must not stream rows after it returns
+        '''
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            bind = self.choose(payload)
+            if bind is None:
+                return f(payload, *args, **kwargs)
+            session = db.session()
+            session.info['read_bind'] = bind
+            try:
+                return f(payload, *args, **kwargs)
+            finally:
+                session.info.pop('read_bind', None)
+        return wrapper
+
+
+replica_router = ReplicaRouter(backend_from_url(REPLICA_STICKY_URL))
+
+
+@on_change
+def stick_to_primary(tables):
+    # the commits of a request are writes of its client
+    payload = g.get('auth_payload') if has_request_context() else None
+    if payload is not None:
+        replica_router.record_write(payload)
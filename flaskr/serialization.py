@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import uuid
+from datetime import date, datetime
+
+from flask import current_app
+from werkzeug.http import http_date
+
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+
+'''
+JSON serialization
+
+    responses are encoded by a pluggable provider, orjson when it is
+    installed and the standard library otherwise (JSON_PROVIDER=auto,
+    the default), or the one named by JSON_PROVIDER=orjson|stdlib
+
+    both write compact JSON with sorted keys, datetimes as HTTP dates and
+    non-ASCII characters as \\u escapes, like flask.jsonify, so clients,
+    ETags and cached bodies see the same bytes either way
+'''
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return http_date(value.utctimetuple())
+    if isinstance(value, date):
+        return http_date(value.timetuple())
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError('Object of type %s is not JSON serializable'
+                    % type(value).__name__)
+
+
+_NON_ASCII = re.compile('[^\x00-\x7f]')
+
+
+def _escape_char(match):
+    code = ord(match.group())
+    if code > 0xffff:
+        # a surrogate pair, as json.dumps writes it
+        code -= 0x10000
+        return '\\u%04x\\u%04x' % (0xd800 | code >> 10, 0xdc00 | code & 0x3ff)
+    return '\\u%04x' % code
+
+
+def ascii_escape(encoded):
+    '''
+    escapes the non-ASCII characters of UTF-8 encoded JSON like
+    json.dumps(ensure_ascii=True), they can only occur inside strings
+    '''
+    if encoded.isascii():
+        return encoded
+    return _NON_ASCII.sub(
+        _escape_char, encoded.decode('utf-8')).encode('ascii')
+
+
+class JSONProvider:
+    '''
+    interface of the encoders used for responses
+    '''
+    name = None
+
+    def dumps(self, value):
+        '''
+        returns the UTF-8 encoded JSON document of `value`
+        '''
+        raise NotImplementedError
+
+
+class StdlibJSONProvider(JSONProvider):
+    name = 'stdlib'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(
+            sort_keys=True, separators=(',', ':'), default=_default)
+
+    def dumps(self, value):
+        return self._encoder.encode(value).encode('utf-8')
+
+
+class OrjsonJSONProvider(JSONProvider):
+    name = 'orjson'
+
+    def __init__(self):
+        # optional dependency, only needed with JSON_PROVIDER=orjson|auto
+        import orjson
+        self._dumps = orjson.dumps
+        # datetimes are handed to _default to keep the HTTP date format
+        self._option = orjson.OPT_SORT_KEYS | \
+            orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, value):
+        # orjson writes raw UTF-8
+        return ascii_escape(
+            self._dumps(value, default=_default, option=self._option))
+
+
+def provider_from_name(name):
+    if name == 'auto':
+        try:
+            return OrjsonJSONProvider()
+        except ImportError:
+            return StdlibJSONProvider()
+    if name == 'orjson':
+        return OrjsonJSONProvider()
+    if name == 'stdlib':
+        return StdlibJSONProvider()
+    raise ValueError('Unsupported JSON provider: ' + name)
+
+
+json_provider = provider_from_name(JSON_PROVIDER)
+
+
+def json_response(value, provider=None):
+    provider = provider or json_provider
+    return current_app.response_class(
+        provider.dumps(value) + b'\n', mimetype='application/json')
+
+
+def json_list_response(envelope, key, rows, format_row, provider=None):
+    '''
+    same document as json_response(dict(envelope, key=[...])), but every
+    row is encoded right after it is formatted, so the list of formatted
+    dicts is never built and the rows are encoded in a single pass
+    '''
+    dumps = (provider or json_provider).dumps
+    items = b'[' + b','.join(dumps(format_row(row)) for row in rows) + b']'
+    return _document_response(dumps, envelope, key, items)
+
+
+def json_encoded_response(envelope, key, encoded, provider=None):
+    '''
+    same document as json_response(dict(envelope, key=value)) for a value
+    already encoded with json_dumps, e.g. read from a cache
+    '''
+    dumps = (provider or json_provider).dumps
+    return _document_response(dumps, envelope, key, encoded)
+
+
+def json_dumps(value, provider=None):
+    return (provider or json_provider).dumps(value)
+
+
+def _document_response(dumps, envelope, key, encoded):
+    members = dict((name, dumps(value)) for name, value in envelope.items())
+    members[key] = encoded
+    body = b','.join(dumps(name) + b':' + members[name]
+                     for name in sorted(members))
+    return current_app.response_class(
+        b'{' + body + b'}\n', mimetype='application/json')
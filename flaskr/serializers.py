@@ -0,0 +1,68 @@
+from sqlalchemy import select
+
+from models import Buyer
+
+BUYER_COLUMNS = ('id', 'name', 'age', 'gender', 'auto_id')
+
+'''
+Row serializers
+
+    read-only list endpoints select plain column tuples with Core and turn
+    them into the dicts of Auto.format() and Buyer.format() with a function
+    built once per column list, so no ORM entity, identity map entry or
+    instrumented attribute is involved
+'''
+
+_serializers = {}
+
+
+def row_serializer(columns):
+    '''
+    returns a function turning a row whose first values are `columns`
+    into {column: value}, built once per column list
+    '''
+    columns = tuple(columns)
+    serializer = _serializers.get(columns)
+    if serializer is None:
+        serializer = _make_serializer(columns)
+        _serializers[columns] = serializer
+    return serializer
+
+
+def _make_serializer(columns):
+    # zip stops after `columns`, extra values at the end of the row are
+    # left out
+    def serializer(row):
+        return dict(zip(columns, row))
+    return serializer
+
+
+def select_columns(model, columns, extra=(), where=()):
+    '''
+    Core select of `columns` of the model table, followed by the `extra`
+    columns that are not part of them, filtered by the `where` predicates
+    '''
+    table = model.__table__
+    names = list(columns)
+    names.extend(column for column in extra if column not in names)
+    query = select([table.c[name] for name in names])
+    for predicate in where:
+        query = query.where(predicate)
+    return query
+
+
+def select_buyers(auto_ids):
+    table = Buyer.__table__
+    return select_columns(
+        Buyer, BUYER_COLUMNS,
+        where=[table.c.auto_id.in_(auto_ids)]).order_by(table.c.id)
+
+
+def add_buyers(buyers, rows):
+    '''
+    appends the buyer rows read with select_buyers to buyers[auto id]
+    '''
+    serialize = row_serializer(BUYER_COLUMNS)
+    for row in rows:
+        buyers[row['auto_id']].append(serialize(row))
+    return buyers
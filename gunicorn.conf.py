@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+
+'''
+Gunicorn configuration
+
+    gunicorn -c gunicorn.conf.py 'flaskr:create_app()'
+
+    every setting is read from the environment, the defaults size the
+    workers and threads from the CPUs available to the process
+
+    every worker may open DB_POOL_SIZE + DB_MAX_OVERFLOW connections to the
+    primary, the workers are capped so that together they stay within
+    DB_MAX_CONNECTIONS, the share of the max_connections of Postgres (100
+    by default) the app may use; a WEB_CONCURRENCY above it is refused
+
+    gunicorn applies every module level name matching one of its settings,
+    the budget is kept under db_ names so it does not set any of them
+
+    the app is preloaded, so create_app and the model imports happen once
+    in the master and are shared copy-on-write by the workers, each worker
+    disposes the inherited engine pools before serving requests
+'''
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def cpu_count():
+    # the CPUs the process may run on, which containers often restrict
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+cpus = cpu_count()
+
+# leaves room below max_connections for superusers, migrations and psql
+db_max_connections = env_int('DB_MAX_CONNECTIONS', 90)
+db_connections_per_worker = \
+    env_int('DB_POOL_SIZE', 5) + env_int('DB_MAX_OVERFLOW', 10)
+
+bind = os.environ.get(
+    'GUNICORN_BIND', '0.0.0.0:' + os.environ.get('PORT', '8000'))
+workers = env_int('WEB_CONCURRENCY', max(1, min(
+    2 * cpus + 1, db_max_connections // db_connections_per_worker)))
+if workers * db_connections_per_worker > db_max_connections:
+    raise RuntimeError(
+        '%d workers may open %d connections each, more than the %d of '
+        'DB_MAX_CONNECTIONS'
+        % (workers, db_connections_per_worker, db_max_connections))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# requests spend most of their time waiting on Postgres or Auth0, threads
+# are capped by the connections the pool of a worker may open
+threads = env_int('GUNICORN_THREADS',
+                  min(2 * cpus, db_connections_per_worker))
+
+preload_app = env_bool('GUNICORN_PRELOAD', True)
+# workers are recycled to cap memory growth, the jitter keeps them from
+# restarting all at once
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+backlog = env_int('GUNICORN_BACKLOG', 2048)
+
+# heartbeat files on tmpfs, a disk backed /tmp can stall the workers
+worker_tmp_dir = os.environ.get(
+    'GUNICORN_WORKER_TMP_DIR',
+    '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # connections opened by the master must not be shared across processes
+    if server.cfg.preload_app:
+        from models import dispose_engines
+        dispose_engines(server.app.wsgi())
@@ -0,0 +1,41 @@
+"""initial schema
+
+Revision ID: 35291c8315b4
+Revises: 
+Create Date: 2020-05-28 21:04:12.482613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '35291c8315b4'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'autos',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('release_date', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'buyers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('age', sa.Integer(), nullable=True),
+        sa.Column('gender', sa.String(), nullable=True),
+        sa.Column('auto_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['auto_id'], ['autos.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('buyers')
+    op.drop_table('autos')
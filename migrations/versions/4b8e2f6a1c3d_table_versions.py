@@ -0,0 +1,33 @@
+"""table versions
+
+Revision ID: 4b8e2f6a1c3d
+Revises: 35291c8315b4
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e2f6a1c3d'
+down_revision = '35291c8315b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases restored from capstone.psql already have the table
+    if 'table_versions' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,30 @@
+"""let the database null buyers.auto_id when their auto is deleted
+
+Revision ID: 6f1a3b9c2d7e
+Revises: 9d2c7e4f8a1b
+Create Date: 2026-10-18 14:12:40.318204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6f1a3b9c2d7e'
+down_revision = '9d2c7e4f8a1b'
+branch_labels = None
+depends_on = None
+
+# the name Postgres gave the unnamed constraint of the first migration
+CONSTRAINT = 'buyers_auto_id_fkey'
+
+
+def upgrade():
+    op.drop_constraint(CONSTRAINT, 'buyers', type_='foreignkey')
+    op.create_foreign_key(CONSTRAINT, 'buyers', 'autos',
+                          ['auto_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    op.drop_constraint(CONSTRAINT, 'buyers', type_='foreignkey')
+    op.create_foreign_key(CONSTRAINT, 'buyers', 'autos',
+                          ['auto_id'], ['id'])
@@ -0,0 +1,67 @@
+"""add indexes on buyers.auto_id and the filter columns
+
+Revision ID: 9d2c7e4f8a1b
+Revises: 4b8e2f6a1c3d
+Create Date: 2026-10-18 09:31:05.602711
+
+"""
+from alembic import op
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2c7e4f8a1b'
+down_revision = '4b8e2f6a1c3d'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_buyers_auto_id', 'buyers', ['auto_id', 'id'], {}),
+    ('ix_buyers_age', 'buyers', ['age', 'id'], {}),
+    ('ix_buyers_gender', 'buyers', ['gender', 'id'], {}),
+    ('ix_buyers_name', 'buyers', ['name', 'id'], {}),
+    ('ix_buyers_name_prefix', 'buyers', ['name'],
+     {'postgresql_ops': {'name': 'varchar_pattern_ops'}}),
+    ('ix_autos_release_date', 'autos', ['release_date', 'id'], {}),
+    ('ix_autos_name', 'autos', ['name', 'id'], {}),
+    ('ix_autos_name_prefix', 'autos', ['name'],
+     {'postgresql_ops': {'name': 'varchar_pattern_ops'}}),
+]
+
+
+def index_columns(columns, options):
+    ops = options.get('postgresql_ops', {})
+    return ', '.join(' '.join(filter(None, (column, ops.get(column))))
+                     for column in columns)
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY does not block writes on large tables,
+        # but cannot run inside the migration transaction
+        with op.get_context().autocommit_block():
+            for name, table, columns, options in INDEXES:
+                # a build that failed halfway leaves an invalid index
+                # behind, which IF NOT EXISTS would keep
+                invalid = op.get_bind().execute(text(
+                    'SELECT 1 FROM pg_index WHERE NOT indisvalid '
+                    'AND indexrelid = to_regclass(:name)'),
+                    name=name).first()
+                if invalid:
+                    op.execute('DROP INDEX CONCURRENTLY %s' % name)
+                op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s '
+                           'ON %s (%s)' % (name, table,
+                                           index_columns(columns, options)))
+    else:
+        for name, table, columns, options in INDEXES:
+            op.create_index(name, table, columns, **options)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, _, _, _ in reversed(INDEXES):
+                op.execute('DROP INDEX CONCURRENTLY IF EXISTS %s' % name)
+    else:
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
@@ -1,33 +1,259 @@
 
 import json
 import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
 
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import (Column, DateTime, ForeignKey, Integer, String,
-                        create_engine)
-from sqlalchemy.orm import relationship
+from flask_sqlalchemy import (SignallingSession, SQLAlchemy, _EngineConnector,
+                              get_state)
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, String,
+                        create_engine, event, exc, select)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
 
 database_name = "capstone"
 # database_path = "postgres://{}/{}".format('localhost:5432', database_name)
 #database_path = "postgres:///{}".format(database_name)
-database_path = "postgresql://{}:{}@{}/{}".format('postgres','123','localhost:5432', database_name)
-#database_path = os.environ['DATABASE_URL']
-db = SQLAlchemy()
+database_path = os.environ.get('DATABASE_URL', "postgresql://{}:{}@{}/{}".format('postgres','123','localhost:5432', database_name))
+# comma separated, read by the endpoints routed by flaskr.replicas
+replica_paths = [path.strip() for path in
+                 os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                 if path.strip()]
+REPLICA_BIND_PREFIX = 'replica_'
+
+'''
+RoutingSession
+        reads go to the bind named by info['read_bind'] while it is set,
+        see flaskr.replicas, flushes and INSERT, UPDATE and DELETE
+        statements always go to the primary
+'''
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        read_bind = self.info.get('read_bind')
+        if read_bind is not None and not self._flushing and \
+                not isinstance(clause, UpdateBase):
+            return get_state(self.app).db.get_engine(self.app, read_bind)
+        return super().get_bind(mapper, clause)
+
+class ReplicaEngineConnector(_EngineConnector):
+
+    def get_options(self, sa_url, echo):
+        # SQLALCHEMY_ENGINE_OPTIONS are those of the primary, a replica
+        # gets the pool settings of its own url, named after its bind
+        if self._bind is None or \
+                not self._bind.startswith(REPLICA_BIND_PREFIX):
+            return super().get_options(sa_url, echo)
+        options = {}
+        self._sa.apply_driver_hacks(self._app, sa_url, options)
+        options.update(engine_options(str(sa_url), self._bind))
+        return options
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def make_connector(self, app=None, bind=None):
+        return ReplicaEngineConnector(self, self.get_app(app), bind)
+
+db = RoutingSQLAlchemy()
+
+'''
+PoolMetrics
+        checkout wait time, timeouts and current usage of the connection
+        pools, per pool name, rendered in the Prometheus text format
+'''
+
+class PoolMetrics:
+
+    def __init__(self):
+        self.pools = weakref.WeakSet()
+        self._waits = {}
+        self._lock = threading.Lock()
+
+    def record_wait(self, name, seconds, timed_out=False):
+        with self._lock:
+            count, total, slowest, timeouts = \
+                self._waits.get(name, (0, 0.0, 0.0, 0))
+            self._waits[name] = (count + 1, total + seconds,
+                                 max(slowest, seconds),
+                                 timeouts + int(timed_out))
+
+    def render(self):
+        with self._lock:
+            waits = dict(self._waits)
+        usage = {}
+        for pool in list(self.pools):
+            usage[pool.name] = (pool.size(), pool.checkedout(),
+                                max(pool.overflow(), 0))
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for pool, value in sorted(samples.items()):
+                lines.append('%s{pool="%s"} %s' % (name, pool, value))
+
+        metric('db_pool_size', 'gauge', 'Connections kept by the pool',
+               {name: values[0] for name, values in usage.items()})
+        metric('db_pool_checked_out', 'gauge', 'Connections in use',
+               {name: values[1] for name, values in usage.items()})
+        metric('db_pool_overflow', 'gauge',
+               'Connections opened beyond the pool size',
+               {name: values[2] for name, values in usage.items()})
+        metric('db_pool_checkout_wait_seconds_count', 'counter',
+               'Connection checkouts',
+               {name: values[0] for name, values in waits.items()})
+        metric('db_pool_checkout_wait_seconds_sum', 'counter',
+               'Seconds spent waiting for a connection',
+               {name: '%.6f' % values[1] for name, values in waits.items()})
+        metric('db_pool_checkout_wait_seconds_max', 'gauge',
+               'Longest wait for a connection',
+               {name: '%.6f' % values[2] for name, values in waits.items()})
+        metric('db_pool_checkout_timeouts_total', 'counter',
+               'Checkouts that gave up after pool_timeout',
+               {name: values[3] for name, values in waits.items()})
+        return '\n'.join(lines) + '\n'
+
+pool_metrics = PoolMetrics()
+
+'''
+InstrumentedQueuePool
+        QueuePool reporting its checkouts to pool_metrics
+        the pool name is the pool_logging_name of the engine
+'''
+
+class InstrumentedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = self._orig_logging_name or 'primary'
+        self._waiting = threading.local()
+        pool_metrics.pools.add(self)
+
+    def _do_get(self):
+        # QueuePool._do_get retries by calling itself
+        if getattr(self._waiting, 'active', False):
+            return super()._do_get()
+
+        self._waiting.active = True
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_wait(
+                self.name, time.perf_counter() - start, timed_out=True)
+            raise
+        finally:
+            self._waiting.active = False
+        pool_metrics.record_wait(self.name, time.perf_counter() - start)
+        return connection
+
+'''
+engine_options(database_path)
+        connection pool settings, read from the environment
+        sqlite uses its own pooling and keeps the defaults
+'''
+
+def engine_options(database_path, pool_name='primary'):
+    if database_path.startswith('sqlite'):
+        return {}
+    pre_ping = os.environ.get('DB_POOL_PRE_PING', 'true')
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_logging_name': pool_name,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': pre_ping.lower() in ('1', 'true', 'yes')
+    }
+
+'''
+SQLite ignores foreign keys, and so ON DELETE, unless every connection
+switches them on
+'''
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 '''
 setup_db(app)
         binds a flask application and a SQLAlchemy service
+        the replicas become the binds replica_0, replica_1, ...
 '''
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_paths=replica_paths):
 
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = {
+        REPLICA_BIND_PREFIX + str(index): path
+        for index, path in enumerate(replica_paths)}
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
     migrate = Migrate(app, db)
 
+'''
+dispose_engines(app)
+        drops the pooled connections of every engine of the app, workers
+        forked from a preloaded app call it so they never share the
+        sockets opened by their parent
+'''
+
+def dispose_engines(app):
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+            db.get_engine(app, bind).dispose()
+
+'''
+unit_of_work()
+        groups writes into one transaction, committed once when the
+        outermost unit exits and rolled back when it exits with an error,
+        so a failed transaction never goes back to the pool
+
+            with unit_of_work():
+                auto.insert()
+                buyer.insert()
+
+        pending objects are flushed together by that commit, or earlier
+        when a query needs them, nested units join the outer one
+        an error caught inside an outer unit does not undo the writes made
+        before it, let it propagate
+'''
+
+@contextmanager
+def unit_of_work():
+    session = db.session()
+    depth = session.info.get('unit_of_work_depth', 0)
+    session.info['unit_of_work_depth'] = depth + 1
+    try:
+        yield session
+        if depth == 0:
+            session.commit()
+    except BaseException:
+        if depth == 0:
+            session.rollback()
+        raise
+    finally:
+        session.info['unit_of_work_depth'] = depth
+
 '''
 Auto
 '''
@@ -35,34 +261,52 @@ Auto
 class Auto(db.Model):
 
     __tablename__ = 'autos'
+    # (column, id) indexes serve both the filters and the keyset pages
+    # the varchar_pattern_ops index serves name prefix searches
+    __table_args__ = (
+        Index('ix_autos_release_date', 'release_date', 'id'),
+        Index('ix_autos_name', 'name', 'id'),
+        Index('ix_autos_name_prefix', 'name',
+              postgresql_ops={'name': 'varchar_pattern_ops'}),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     release_date = Column(DateTime)
-    buyers = relationship('Buyer', backref="autos", lazy=True)
+    # the database nulls buyers.auto_id, deletes never load the buyers
+    buyers = relationship('Buyer', backref="autos", lazy=True,
+                          order_by='Buyer.id', passive_deletes=True)
 
     def __init__(self, name, release_date):
         self.name = name
         self.release_date = release_date
 
     def insert(self):
-        db.session.add(self)
-        db.session.commit()
+        with unit_of_work() as session:
+            session.add(self)
 
     def update(self):
-        db.session.commit()
+        with unit_of_work() as session:
+            session.add(self)
 
     def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+        with unit_of_work() as session:
+            session.delete(self)
 
-    def format(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'release_date': self.release_date,
-            'buyers': list(map(lambda buyer: buyer.format(), self.buyers))
-        }
+    def format(self, include_buyers=True, fields=None):
+        if fields is None:
+            auto = {
+                'id': self.id,
+                'name': self.name,
+                'release_date': self.release_date
+            }
+        else:
+            # only the loaded columns are read, see flaskr.fields
+            auto = {field: getattr(self, field) for field in fields}
+        if include_buyers:
+            auto['buyers'] = list(
+                map(lambda buyer: buyer.format(), self.buyers))
+        return auto
 
 '''
 Buyer
@@ -71,12 +315,21 @@ Buyer
 class Buyer(db.Model):
 
     __tablename__ = 'buyers'
+    __table_args__ = (
+        Index('ix_buyers_auto_id', 'auto_id', 'id'),
+        Index('ix_buyers_age', 'age', 'id'),
+        Index('ix_buyers_gender', 'gender', 'id'),
+        Index('ix_buyers_name', 'name', 'id'),
+        Index('ix_buyers_name_prefix', 'name',
+              postgresql_ops={'name': 'varchar_pattern_ops'}),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     age = Column(Integer)
     gender = Column(String)
-    auto_id = Column(Integer, ForeignKey('autos.id'), nullable=True)
+    auto_id = Column(Integer, ForeignKey('autos.id', ondelete='SET NULL'),
+                     nullable=True)
 
     def __init__(self, name, age, gender, auto_id):
         self.name = name
@@ -85,15 +338,16 @@ class Buyer(db.Model):
         self.auto_id = auto_id
 
     def insert(self):
-        db.session.add(self)
-        db.session.commit()
+        with unit_of_work() as session:
+            session.add(self)
 
     def update(self):
-        db.session.commit()
+        with unit_of_work() as session:
+            session.add(self)
 
     def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+        with unit_of_work() as session:
+            session.delete(self)
 
     def format(self):
         return {
@@ -104,4 +358,179 @@ class Buyer(db.Model):
             "auto_id": self.auto_id
         }
 
+'''
+TableVersion
+        change counter and time of the last change of each table
+        bumped in the same transaction as the change itself, so read
+        endpoints can answer conditional requests without loading rows
+'''
+
+class TableVersion(db.Model):
+
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+    @classmethod
+    def current(cls, *tables):
+        '''
+        returns {table name: (version, updated_at)}
+        tables never changed through the app are reported as (0, None)
+        '''
+        rows = db.session.execute(cls.select_current(*tables))
+        return cls.versions_from_rows(tables, rows)
+
+    @classmethod
+    def select_current(cls, *tables):
+        table = cls.__table__
+        return select([table.c.name, table.c.version, table.c.updated_at]) \
+            .where(table.c.name.in_(tables))
+
+    @staticmethod
+    def versions_from_rows(tables, rows):
+        versions = {name: (0, None) for name in tables}
+        for name, version, updated_at in rows:
+            versions[name] = (version, updated_at)
+        return versions
+
+def bump_versions(connection, tables):
+    table = TableVersion.__table__
+    now = datetime.utcnow()
+    # a fixed order keeps concurrent writers from deadlocking
+    for name in sorted(tables):
+        if connection.dialect.name == 'postgresql':
+            # the first writes to a table may run concurrently, an UPDATE
+            # then INSERT would let both insert the missing row
+            statement = postgresql.insert(table).values(
+                name=name, version=1, updated_at=now)
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={'version': table.c.version + 1, 'updated_at': now}))
+            continue
+        result = connection.execute(
+            table.update()
+            .where(table.c.name == name)
+            .values(version=table.c.version + 1, updated_at=now))
+        if result.rowcount == 0:
+            connection.execute(
+                table.insert().values(name=name, version=1, updated_at=now))
+
+'''
+Change tracking
+        every commit that changed tables through the ORM, Query.update,
+        Query.delete or mark_changed bumps their versions and is reported
+        to the functions registered with on_change once it is committed
+'''
+
+change_listeners = []
+
+def on_change(listener):
+    change_listeners.append(listener)
+    return listener
+
+def record_changes(session, tables):
+    tables = set(tables) - {TableVersion.__tablename__}
+    if tables:
+        bump_versions(session.connection(), tables)
+        session.info.setdefault('changed_tables', set()).update(tables)
+
+'''
+mark_changed(*tables)
+        bumps the versions of tables changed with Core statements
+'''
+
+def mark_changed(*tables):
+    record_changes(db.session(), tables)
+
+'''
+update_returning(model, id, values)
+        UPDATE ... WHERE id = :id RETURNING <every column>, a single
+        statement that returns the updated row, or None when no row has
+        this id, and bumps the version of the table when one matched
+        dialects without RETURNING, SQLite under SQLAlchemy 1.3, read the
+        row back with a SELECT in the same transaction
+        run it inside a unit_of_work
+'''
+
+def supports_returning(connection):
+    # set once the dialect has seen the server, e.g. Postgres 8.2 or later
+    return connection.dialect.implicit_returning
+
+def update_returning(model, id, values):
+    table = model.__table__
+    session = db.session()
+    where = table.c.id == id
+    if not values:
+        return session.execute(select(table.c).where(where)).first()
+
+    statement = table.update().where(where).values(**values)
+    if supports_returning(session.connection()):
+        row = session.execute(statement.returning(*table.c)).first()
+    else:
+        row = None
+        if session.execute(statement).rowcount:
+            row = session.execute(select(table.c).where(where)).first()
+    if row is not None:
+        mark_changed(table.name)
+    return row
+
+'''
+delete_returning(model, ids, *columns)
+        DELETE ... WHERE id IN (:ids) RETURNING id, *columns, a single
+        statement that returns the deleted rows, whatever the number of
+        rows referencing them, the database applies the ON DELETE of the
+        foreign keys and the versions of those tables are bumped too
+        dialects without RETURNING select the rows first
+        run it inside a unit_of_work
+'''
+
+def dependent_tables(table):
+    return {fk.parent.table.name
+            for other in table.metadata.sorted_tables
+            for fk in other.foreign_keys
+            if fk.column.table is table and fk.ondelete}
+
+def delete_returning(model, ids, *columns):
+    table = model.__table__
+    columns = [table.c.id] + [table.c[name] for name in columns]
+    session = db.session()
+    if supports_returning(session.connection()):
+        rows = session.execute(table.delete().where(table.c.id.in_(ids))
+                               .returning(*columns)).fetchall()
+    else:
+        rows = session.execute(
+            select(columns).where(table.c.id.in_(ids))).fetchall()
+        if rows:
+            session.execute(table.delete().where(
+                table.c.id.in_([row.id for row in rows])))
+    if rows:
+        mark_changed(table.name, *dependent_tables(table))
+    return rows
+
+@event.listens_for(Session, 'after_flush')
+def track_changes(session, flush_context):
+    changed = set()
+    for obj in session.new | session.deleted:
+        changed.add(obj.__tablename__)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            changed.add(obj.__tablename__)
+    record_changes(session, changed)
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def track_bulk_changes(context):
+    record_changes(context.session, [context.mapper.local_table.name])
+
+@event.listens_for(Session, 'after_commit')
+def notify_changes(session):
+    changed = session.info.pop('changed_tables', None)
+    if changed:
+        for listener in change_listeners:
+            listener(changed)
 
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+    session.info.pop('changed_tables', None)
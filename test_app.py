@@ -1,26 +1,78 @@
+import gzip
 import json
 import os
 import unittest
+from contextlib import contextmanager
+from datetime import datetime
+from unittest import mock
 
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 
-from flaskr import create_app
-from models import Auto, Buyer, setup_db
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'capstone')
+
+from auth.auth import use_jwks  # noqa: E402
+from auth.testing import LocalIssuer  # noqa: E402
+from flaskr import create_app  # noqa: E402
+from flaskr import instrumentation  # noqa: E402
+from flaskr.bulk import bulk_insert  # noqa: E402
+from flaskr.caching import (LRUCacheBackend, RedisCacheBackend,  # noqa: E402
+                            RowCache, response_cache, row_cache)
+from flaskr.serialization import json_list_response  # noqa: E402
+from models import Auto, Buyer, db, setup_db  # noqa: E402
+
+
+# the permissions of the roles, as configured in Auth0
+ROLES = {
+    "Casting Assistant": ['view:autos', 'view:buyers'],
+    "Casting Director": ['view:autos', 'view:buyers', 'post:buyers',
+                         'delete:buyers', 'update:buyers', 'update:autos'],
+    "Executive Producer": ['view:autos', 'view:buyers', 'post:buyers',
+                           'delete:buyers', 'update:buyers', 'update:autos',
+                           'post:autos', 'delete:autos']
+}
+
+
+class FakeRedis:
+    """Redis compatible stand-in, keeps values in a dict"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
 
 
 class CapstoneTestCase(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer()
+        cls.auth_headers = {
+            role: cls.issuer.auth_header(permissions)
+            for role, permissions in ROLES.items()
+        }
+
     def setUp(self):
         self.app = create_app()
         self.client = self.app.test_client
         self.database_name = "capstone_test"
-        self.database_path = "postgres:///{}".format(self.database_name)
+        self.database_path = os.environ.get(
+            'TEST_DATABASE_URL', "postgres:///{}".format(self.database_name))
         setup_db(self.app, self.database_path)
 
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
+            self.db = db
             # create all tables
             self.db.create_all()
 
@@ -36,23 +88,81 @@ class CapstoneTestCase(unittest.TestCase):
             "auto_id": 2
         }
 
-        # Set up authentication tokens info
-        with open('auth_config.json', 'r') as f:
-            self.auth = json.loads(f.read())
-
-        assistant_jwt = self.auth["roles"]["Casting Assistant"]["jwt_token"]
-        director_jwt = self.auth["roles"]["Casting Director"]["jwt_token"]
-        producer_jwt = self.auth["roles"]["Executive Producer"]["jwt_token"]
-        self.auth_headers = {
-            "Casting Assistant": f'Bearer {assistant_jwt}',
-            "Casting Director": f'Bearer {director_jwt}',
-            "Executive Producer": f'Bearer {producer_jwt}'
-        }
+        # tokens of the roles are signed by the local issuer
+        use_jwks(self.issuer.jwks())
 
     def tearDown(self):
         """Executed after reach test"""
         pass
 
+    def insert_autos(self, count, buyers_per_auto=0):
+        """Inserts autos with buyers, removed again after the test"""
+        with self.app.app_context():
+            autos = [Auto(name='Seeded auto %d' % i,
+                          release_date=datetime(2020, 1, 1))
+                     for i in range(count)]
+            db.session.add_all(autos)
+            db.session.flush()
+            buyers = [Buyer(name='Seeded buyer', age=30, gender='F',
+                            auto_id=auto.id)
+                      for auto in autos for _ in range(buyers_per_auto)]
+            db.session.add_all(buyers)
+            db.session.commit()
+            auto_ids = [auto.id for auto in autos]
+            buyer_ids = [buyer.id for buyer in buyers]
+        self.addCleanup(self.remove_rows, auto_ids, buyer_ids)
+        return auto_ids
+
+    def insert_buyers(self, auto_id, buyers):
+        """Inserts (name, age, gender) buyers of an auto for the test"""
+        with self.app.app_context():
+            rows = [Buyer(name=name, age=age, gender=gender, auto_id=auto_id)
+                    for name, age, gender in buyers]
+            db.session.add_all(rows)
+            db.session.commit()
+            buyer_ids = [buyer.id for buyer in rows]
+        self.addCleanup(self.remove_rows, [], buyer_ids)
+        return buyer_ids
+
+    def get_all_pages(self, url, key, headers):
+        """Follows next_cursor and returns the rows of every page"""
+        rows = []
+        cursor = None
+        while True:
+            page_url = url + ('&after=' + cursor if cursor else '')
+            res = self.client().get(page_url, headers=headers)
+            self.assertEqual(res.status_code, 200)
+            data = json.loads(res.data)
+            rows.extend(data[key])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return rows
+
+    def remove_rows(self, auto_ids, buyer_ids=()):
+        with self.app.app_context():
+            Buyer.query.filter(Buyer.id.in_(buyer_ids)) \
+                .delete(synchronize_session=False)
+            Auto.query.filter(Auto.id.in_(auto_ids)) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+
+    @contextmanager
+    def count_queries(self):
+        """Collects the statements sent to the database"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(
+                engine, 'before_cursor_execute', before_cursor_execute)
+
     def test_get_autos(self):
         header_obj = {
             "Authorization": self.auth_headers["Casting Assistant"]
@@ -64,6 +174,560 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(type(data["autos"]), type([]))
 
+    def test_get_autos_query_count_is_constant(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        query_counts = []
+        for _ in range(2):
+            self.insert_autos(5, buyers_per_auto=2)
+            with self.count_queries() as statements:
+                res = self.client().get('/autos', headers=header_obj)
+            self.assertEqual(res.status_code, 200)
+            query_counts.append(len(statements))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_get_autos_keyset_pagination(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_ids = self.insert_autos(5)
+
+        seen_ids = []
+        cursor = None
+        while True:
+            url = '/autos?limit=2'
+            if cursor:
+                url += '&after=' + cursor
+            res = self.client().get(url, headers=header_obj)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertLessEqual(len(data['autos']), 2)
+            seen_ids.extend(auto['id'] for auto in data['autos'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(seen_ids, sorted(seen_ids))
+        self.assertEqual(len(seen_ids), len(set(seen_ids)))
+        self.assertTrue(set(auto_ids).issubset(seen_ids))
+
+    def test_get_autos_matches_format(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(3, buyers_per_auto=2)
+        for path, model, key in (('/autos?limit=5', Auto, 'autos'),
+                                 ('/buyers?limit=5', Buyer, 'buyers')):
+            res = self.client().get(path, headers=header_obj)
+            next_cursor = json.loads(res.data)['next_cursor']
+
+            def format_row(row):
+                formatted = row.format()
+                formatted.get('buyers', []).sort(key=lambda buyer: buyer['id'])
+                return formatted
+
+            with self.app.test_request_context():
+                rows = model.query.order_by(model.id).limit(5).all()
+                expected = json_list_response(
+                    {"success": True, "next_cursor": next_cursor}, key,
+                    rows, format_row).get_data()
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.data, expected)
+
+    def test_get_auto_by_id(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_id = self.insert_autos(1, buyers_per_auto=2)[0]
+        res = self.client().get('/autos/%d' % auto_id, headers=header_obj)
+        data = json.loads(res.data)
+        listed = json.loads(self.client().get(
+            '/autos?ids=%d' % auto_id, headers=header_obj).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['auto'], listed['autos'][0])
+        self.assertEqual(len(data['auto']['buyers']), 2)
+
+        res = self.client().get('/autos/%d?fields=name' % auto_id,
+                                headers=header_obj)
+        self.assertEqual(set(json.loads(res.data)['auto']), {'id', 'name'})
+
+    def test_get_buyer_by_id(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_id = self.insert_autos(1)[0]
+        buyer_id = self.insert_buyers(auto_id, [('Detail buyer', 33, 'F')])[0]
+        res = self.client().get('/buyers/%d' % buyer_id, headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['buyer'], {
+            'id': buyer_id, 'name': 'Detail buyer', 'age': 33,
+            'gender': 'F', 'auto_id': auto_id})
+
+    def test_get_by_id_fail(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        for path in ('/autos/999999', '/buyers/999999'):
+            res = self.client().get(path, headers=header_obj)
+            self.assertEqual(res.status_code, 404)
+            self.assertFalse(json.loads(res.data)['success'])
+
+            res = self.client().get(path)
+            self.assertEqual(res.status_code, 401)
+
+    def test_get_autos_by_ids(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_ids = self.insert_autos(4, buyers_per_auto=1)
+        ids = ','.join(str(id) for id in auto_ids[:3])
+
+        with self.count_queries() as statements:
+            res = self.client().get('/autos?ids=' + ids, headers=header_obj)
+        data = json.loads(res.data)
+        selects = [statement for statement in statements
+                   if 'FROM autos' in statement]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([auto['id'] for auto in data['autos']],
+                         auto_ids[:3])
+        self.assertEqual(len(selects), 1)
+        self.assertIn(' IN ', selects[0])
+
+        res = self.client().get('/buyers?ids=' + ids + ',x',
+                                headers=header_obj)
+        self.assertEqual(res.status_code, 400)
+
+    def test_row_cache_is_invalidated_by_writes(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        auto_id = self.insert_autos(1)[0]
+        buyer_id = self.insert_buyers(auto_id, [('Cached buyer', 30, 'F')])[0]
+
+        with mock.patch.object(row_cache, 'ttl', 60):
+            self.client().get('/autos/%d' % auto_id, headers=header_obj)
+            with self.count_queries() as statements:
+                res = self.client().get('/autos/%d' % auto_id,
+                                        headers=header_obj)
+            # only the table versions of @conditional are read
+            self.assertEqual(len(statements), 1)
+            self.assertEqual(json.loads(res.data)['auto']['buyers'][0]
+                             ['name'], 'Cached buyer')
+
+            res = self.client().patch('/buyers/%d' % buyer_id,
+                                      json={'name': 'Renamed buyer'},
+                                      headers=header_obj)
+            self.assertEqual(res.status_code, 200)
+            for path, buyer in (('/autos/%d' % auto_id,
+                                 lambda data: data['auto']['buyers'][0]),
+                                ('/buyers/%d' % buyer_id,
+                                 lambda data: data['buyer'])):
+                res = self.client().get(path, headers=header_obj)
+                self.assertEqual(buyer(json.loads(res.data))['name'],
+                                 'Renamed buyer')
+
+            res = self.client().delete('/buyers/%d' % buyer_id,
+                                       headers=header_obj)
+            self.assertEqual(res.status_code, 200)
+            res = self.client().get('/autos/%d' % auto_id, headers=header_obj)
+            self.assertEqual(json.loads(res.data)['auto']['buyers'], [])
+
+    def test_row_generation_counters_expire(self):
+        now = [0]
+        backend = LRUCacheBackend(100, clock=lambda: now[0])
+        cache = RowCache(backend, ttl=60)
+        key = 'generation:rows:autos:1'
+
+        cache.set('autos', 1, 'full', b'first')
+        cache.invalidate('autos', 1)
+        self.assertIsNone(cache.get('autos', 1, 'full'))
+        cache.set('autos', 1, 'full', b'second')
+        generation = backend.get(key)
+
+        now[0] = 61
+        self.assertIsNone(backend.get(key))
+        self.assertNotIn(key, backend._counters)
+        self.assertIsNone(cache.get('autos', 1, 'full'))
+
+        # a new life of the counter does not reach the entries of the last
+        cache.invalidate('autos', 1)
+        self.assertGreater(backend.get(key), generation)
+        self.assertIsNone(cache.get('autos', 1, 'full'))
+
+    def test_get_autos_pagination_fail_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        for query in ('limit=0', 'limit=abc', 'after=not-a-cursor'):
+            res = self.client().get('/autos?' + query, headers=header_obj)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+
+    def test_get_autos_filtered(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_ids = self.insert_autos(3)
+        with self.app.app_context():
+            for auto_id, day in zip(auto_ids, (1, 15, 28)):
+                auto = Auto.query.get(auto_id)
+                auto.name = 'Filtered auto %d' % day
+                auto.release_date = datetime(1999, 2, day)
+            db.session.commit()
+
+        res = self.client().get(
+            '/autos?release_date_min=1999-02-10&release_date_max=1999-02-28'
+            '&name=Filtered%20auto', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([auto['id'] for auto in data['autos']],
+                         auto_ids[1:])
+
+    def test_get_autos_sorted_pages(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_ids = self.insert_autos(5)
+        with self.app.app_context():
+            for auto_id, day in zip(auto_ids, (3, 1, 3, 2, 1)):
+                Auto.query.get(auto_id).release_date = datetime(1998, 1, day)
+            db.session.commit()
+
+        autos = self.get_all_pages(
+            '/autos?limit=2&sort=-release_date&release_date_max=1998-12-31',
+            'autos', header_obj)
+
+        self.assertEqual([auto['id'] for auto in autos], [
+            auto_ids[2], auto_ids[0], auto_ids[3], auto_ids[4], auto_ids[1]])
+
+    def test_get_autos_filter_fail_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        for query in ('release_date_min=yesterday', 'name=',
+                      'release_date_min=2020-02-01'
+                      '&release_date_max=2020-01-01',
+                      'sort=title', 'sort=age'):
+            res = self.client().get('/autos?' + query, headers=header_obj)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+
+    def test_get_autos_sparse_fields(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(2, buyers_per_auto=2)
+        with self.count_queries() as statements:
+            res = self.client().get('/autos?fields=name&limit=1000',
+                                    headers=header_obj)
+        data = json.loads(res.data)
+        selects = [statement for statement in statements
+                   if 'FROM autos' in statement]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data['autos'][0]), {'id', 'name'})
+        self.assertFalse(any('FROM buyers' in statement
+                             for statement in statements))
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('release_date', selects[0].split('FROM')[0])
+
+    def test_get_autos_sparse_fields_with_buyers(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_id = self.insert_autos(1, buyers_per_auto=2)[0]
+        res = self.client().get(
+            '/autos?fields=release_date&include=buyers&sort=-id&limit=1',
+            headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['autos'][0]['id'], auto_id)
+        self.assertEqual(set(data['autos'][0]),
+                         {'id', 'release_date', 'buyers'})
+        self.assertEqual(len(data['autos'][0]['buyers']), 2)
+
+    def test_get_autos_without_buyers(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(1, buyers_per_auto=2)
+        with self.count_queries() as statements:
+            res = self.client().get('/autos?include=', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('buyers', data['autos'][0])
+        self.assertFalse(any('FROM buyers' in statement
+                             for statement in statements))
+
+    def test_get_autos_fields_fail_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        for query in ('fields=', 'fields=name,title', 'include=owners',
+                      'fields=buyers'):
+            res = self.client().get('/autos?' + query, headers=header_obj)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+
+    def test_export_autos_with_buyers(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_ids = self.insert_autos(3, buyers_per_auto=2)
+        res = self.client().get('/autos/export?include=buyers',
+                                headers=header_obj)
+        lines = res.get_data(as_text=True).splitlines()
+        autos = {auto['id']: auto for auto in map(json.loads, lines)}
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        for auto_id in auto_ids:
+            self.assertEqual(len(autos[auto_id]['buyers']), 2)
+            self.assertTrue(all(buyer['auto_id'] == auto_id
+                                for buyer in autos[auto_id]['buyers']))
+
+    def test_export_autos_without_buyers(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(3, buyers_per_auto=1)
+        with self.count_queries() as statements:
+            res = self.client().get('/autos/export', headers=header_obj)
+            lines = res.get_data(as_text=True).splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(any('FROM buyers' in s for s in statements))
+        self.assertFalse(any('buyers' in json.loads(line) for line in lines))
+
+    def test_export_autos_sparse_fields(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(2)
+        res = self.client().get('/autos/export?fields=name',
+                                headers=header_obj)
+        lines = res.get_data(as_text=True).splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(set(json.loads(line)) == {'id', 'name'}
+                            for line in lines))
+
+    def test_export_buyers(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(2, buyers_per_auto=2)
+        res = self.client().get('/buyers/export', headers=header_obj)
+        buyers = [json.loads(line)
+                  for line in res.get_data(as_text=True).splitlines()]
+        ids = [buyer['id'] for buyer in buyers]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreaterEqual(len(buyers), 4)
+        self.assertEqual(ids, sorted(ids))
+
+    def test_get_autos_not_modified(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        res = self.client().get('/autos', headers=header_obj)
+        etag = res.headers['ETag']
+
+        with self.count_queries() as statements:
+            res = self.client().get(
+                '/autos', headers=dict(header_obj, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('table_versions', statements[0])
+
+    def test_get_autos_compressed(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"],
+            "Accept-Encoding": "gzip"
+        }
+        self.insert_autos(20, buyers_per_auto=2)
+        res = self.client().get('/autos?limit=20', headers=header_obj)
+        etag = res.headers['ETag']
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(data['autos']), 20)
+        self.assertTrue(etag.startswith('W/'))
+
+        res = self.client().get('/autos?limit=20', headers=dict(
+            header_obj, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client().get('/autos/export', headers=header_obj)
+        lines = gzip.decompress(res.data).splitlines()
+        self.assertNotIn('Content-Length', res.headers)
+        self.assertGreaterEqual(len(lines), 20)
+
+    def test_get_autos_etag_changes_on_write(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        res = self.client().get('/autos', headers=header_obj)
+        etag = res.headers['ETag']
+
+        self.insert_autos(1, buyers_per_auto=1)
+        res = self.client().get(
+            '/autos', headers=dict(header_obj, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertIsNotNone(res.headers['Last-Modified'])
+
+        res = self.client().get(
+            '/autos', headers=dict(header_obj, **{
+                'If-Modified-Since': res.headers['Last-Modified']}))
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_buyers_etag_changes_on_bulk_insert(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Director"]
+        }
+        auto_id, = self.insert_autos(1)
+        res = self.client().get('/buyers', headers=header_obj)
+        etag = res.headers['ETag']
+
+        buyer = dict(self.buyer, auto_id=auto_id)
+        self.client().post('/buyers/bulk', json=[buyer], headers=header_obj)
+        with self.app.app_context():
+            created = Buyer.query.filter(Buyer.auto_id == auto_id).all()
+            self.addCleanup(self.remove_rows, [],
+                            [buyer.id for buyer in created])
+        res = self.client().get(
+            '/buyers', headers=dict(header_obj, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_get_autos_is_cached(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(2, buyers_per_auto=1)
+        first = self.client().get('/autos', headers=header_obj)
+        with self.count_queries() as statements:
+            second = self.client().get('/autos', headers=header_obj)
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('table_versions', statements[0])
+
+    def test_get_autos_cache_is_invalidated_by_insert(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.client().get('/autos?limit=1000', headers=header_obj)
+        auto_id, = self.insert_autos(1)
+        res = self.client().get('/autos?limit=1000', headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertIn(auto_id, [auto['id'] for auto in data['autos']])
+
+    def test_get_buyers_cache_is_scoped_by_permissions(self):
+        self.insert_autos(1, buyers_per_auto=1)
+        self.client().get('/buyers', headers={
+            "Authorization": self.auth_headers["Casting Assistant"]})
+        with self.count_queries() as statements:
+            res = self.client().get('/buyers', headers={
+                "Authorization": self.auth_headers["Casting Director"]})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(any('FROM buyers' in s for s in statements))
+
+    def test_get_buyers_with_redis_backend(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        backend = response_cache.backend
+        response_cache.backend = RedisCacheBackend(FakeRedis())
+        self.addCleanup(setattr, response_cache, 'backend', backend)
+
+        first = self.client().get('/buyers', headers=header_obj)
+        with self.count_queries() as statements:
+            second = self.client().get('/buyers', headers=header_obj)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(len(statements), 1)
+
+        self.insert_autos(1, buyers_per_auto=1)
+        with self.count_queries() as statements:
+            self.client().get('/buyers', headers=header_obj)
+        self.assertTrue(any('FROM buyers' in s for s in statements))
+
+    def test_get_metrics(self):
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/plain')
+        self.assertIn('# TYPE db_pool_checked_out gauge',
+                      res.get_data(as_text=True))
+
+    def test_server_timing_header(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(1)
+        with self.assertLogs('flaskr.requests', 'INFO') as logs:
+            res = self.client().get('/autos', headers=header_obj)
+        timing = res.headers['Server-Timing']
+        fields = json.loads(logs.records[-1].getMessage())
+
+        self.assertEqual(res.status_code, 200)
+        for phase in ('auth;dur=', 'db;dur=', 'serialize;dur=', 'total;dur='):
+            self.assertIn(phase, timing)
+        self.assertIn('desc="%d queries"' % fields['db_queries'], timing)
+        self.assertGreaterEqual(fields['db_queries'], 2)
+        self.assertEqual(fields['path'], '/autos')
+        self.assertEqual(fields['status'], 200)
+
+    def test_server_timing_includes_compression(self):
+        # after_request functions run in reverse order of registration
+        order = [f.__name__ for f in
+                 reversed(self.app.after_request_funcs[None])]
+
+        self.assertLess(order.index('compress_response'),
+                        order.index('report_request'))
+
+    def test_slow_query_log(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        with mock.patch.object(instrumentation, 'SLOW_QUERY_MS', 0):
+            with self.assertLogs('flaskr.sql', 'WARNING') as logs:
+                self.client().get('/buyers?limit=7', headers=header_obj)
+
+        records = [record for record in logs.records
+                   if 'FROM buyers' in record.statement]
+        parameters = records[0].parameters
+        if isinstance(parameters, dict):
+            parameters = parameters.values()
+
+        self.assertEqual(len(records), 1)
+        self.assertIn(7 + 1, parameters)
+
     def test_get_buyers(self):
         header_obj = {
             "Authorization": self.auth_headers["Casting Assistant"]
@@ -74,6 +738,7 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['success'])
         self.assertEqual(type(data["buyers"]), type([]))
+        self.assertIn('next_cursor', data)
 
     def test_get_buyers_by_director(self):
         header_obj = {
@@ -86,6 +751,86 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(type(data["buyers"]), type([]))
 
+    def test_get_buyers_filtered(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_id = self.insert_autos(1)[0]
+        buyer_ids = self.insert_buyers(auto_id, [
+            ('Ada 100%', 31, 'F'), ('Ada_B', 40, 'F'), ('Ada C', 35, 'M'),
+            ('Bea', 33, 'F'), ('Ada D', 50, 'F')])
+
+        res = self.client().get(
+            '/buyers?auto_id=%d&gender=F&age_min=31&age_max=45&name=Ada'
+            % auto_id, headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([buyer['id'] for buyer in data['buyers']],
+                         buyer_ids[:2])
+
+        # wildcards in the prefix match literally
+        res = self.client().get(
+            '/buyers?auto_id=%d&name=Ada_' % auto_id, headers=header_obj)
+        self.assertEqual([buyer['id'] for buyer in json.loads(res.data)
+                          ['buyers']], [buyer_ids[1]])
+
+    def test_get_buyers_sorted_pages_with_nulls(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_id = self.insert_autos(1)[0]
+        buyer_ids = self.insert_buyers(auto_id, [
+            ('Sorted', 30, 'F'), ('Sorted', None, 'F'), ('Sorted', 20, 'M'),
+            ('Sorted', 30, 'M'), ('Sorted', None, 'M')])
+        url = '/buyers?limit=2&auto_id=%d&sort=' % auto_id
+
+        ascending = self.get_all_pages(url + 'age', 'buyers', header_obj)
+        descending = self.get_all_pages(url + '-age', 'buyers', header_obj)
+
+        expected = [buyer_ids[i] for i in (2, 0, 3, 1, 4)]
+        self.assertEqual([buyer['id'] for buyer in ascending], expected)
+        self.assertEqual([buyer['id'] for buyer in descending],
+                         expected[::-1])
+
+    def test_ascending_pages_are_read_without_or(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        auto_id = self.insert_autos(1)[0]
+        self.insert_buyers(auto_id, [('Sorted', 30, 'F'), ('Sorted', 20, 'M')])
+        res = self.client().get('/buyers?limit=1&sort=age&auto_id=%d'
+                                % auto_id, headers=header_obj)
+        cursor = json.loads(res.data)['next_cursor']
+
+        with self.count_queries() as statements:
+            self.client().get('/buyers?limit=1&sort=age&auto_id=%d&after=%s'
+                              % (auto_id, cursor), headers=header_obj)
+        page = [statement for statement in statements
+                if 'FROM buyers' in statement]
+        # an OR of the (age, id) range and the nulls is no index range
+        self.assertEqual(len(page), 1)
+        self.assertIn('UNION ALL', page[0])
+        self.assertNotIn(' OR ', page[0])
+
+    def test_get_buyers_filter_fail_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Assistant"]
+        }
+        self.insert_autos(1, buyers_per_auto=2)
+        res = self.client().get('/buyers?limit=1&sort=age',
+                                headers=header_obj)
+        age_cursor = json.loads(res.data)['next_cursor']
+
+        for query in ('age_min=old', 'age_min=-1', 'age_min=40&age_max=30',
+                      'auto_id=x', 'gender=', 'sort=release_date',
+                      'sort=--age', 'sort=name&after=' + age_cursor):
+            res = self.client().get('/buyers?' + query, headers=header_obj)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+
     def test_get_buyer_fail_401(self):
         res = self.client().get('/buyers')
         data = json.loads(res.data)
@@ -130,16 +875,131 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 403)
         self.assertFalse(data['success'])
 
+    def test_create_autos_bulk(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        autos = [
+            {"name": "Bulk auto 1", "release_date": "2020-02-19"},
+            {"name": "Bulk auto 2"},
+            {"name": "Bulk auto 3", "release_date": "19-02-2020"},
+            {"name": "Bulk auto 4", "release_date": "2021-03-01"}
+        ]
+        res = self.client().post('/autos/bulk',
+                                 json=autos, headers=header_obj)
+        data = json.loads(res.data)
+        with self.app.app_context():
+            created = Auto.query.filter(Auto.name.like('Bulk auto %')).all()
+            self.addCleanup(self.remove_rows, [auto.id for auto in created])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2])
+        self.assertEqual(data['errors'][0]['message'],
+                         "Missing field for Auto")
+        self.assertEqual(len(created), 2)
+
+    def test_create_autos_bulk_fail_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        res = self.client().post('/autos/bulk',
+                                 json=self.auto, headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_create_buyers_bulk(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Director"]
+        }
+        auto_id, = self.insert_autos(1)
+        buyers = [
+            {"name": "Bulk buyer", "age": "45", "gender": "F",
+             "auto_id": auto_id},
+            {"name": "Bulk buyer", "age": 30, "gender": "M",
+             "auto_id": -1},
+            {"name": "Bulk buyer", "age": 30, "gender": "M",
+             "auto_id": auto_id}
+        ]
+        with self.count_queries() as statements:
+            res = self.client().post('/buyers/bulk',
+                                     json=buyers, headers=header_obj)
+        data = json.loads(res.data)
+        with self.app.app_context():
+            created = Buyer.query.filter(Buyer.auto_id == auto_id).all()
+            self.addCleanup(self.remove_rows, [],
+                            [buyer.id for buyer in created])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+        self.assertEqual(sorted(buyer.age for buyer in created), [30, 45])
+        inserts = [s for s in statements if s.startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_create_buyers_bulk_type_errors(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Casting Director"]
+        }
+        auto_id, = self.insert_autos(1)
+        buyers = [
+            {"name": {"first": "Bulk"}, "age": 30, "gender": "M",
+             "auto_id": auto_id},
+            {"name": "Bulk buyer", "age": 30, "gender": 1,
+             "auto_id": auto_id},
+            {"name": "Bulk buyer", "age": 30, "gender": "M",
+             "auto_id": auto_id}
+        ]
+        res = self.client().post('/buyers/bulk',
+                                 json=buyers, headers=header_obj)
+        data = json.loads(res.data)
+        with self.app.app_context():
+            created = Buyer.query.filter(Buyer.auto_id == auto_id).all()
+            self.addCleanup(self.remove_rows, [],
+                            [buyer.id for buyer in created])
+
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['errors'], [
+            {"index": 0, "message": "name must be a string"},
+            {"index": 1, "message": "gender must be a string"}
+        ])
+
+    def test_bulk_insert_retries_rejected_chunks(self):
+        existing_id, = self.insert_autos(1)
+        new_ids = [900001, 900002]
+        self.addCleanup(self.remove_rows, new_ids)
+        rows = [{'id': id, 'name': 'Retried auto',
+                 'release_date': datetime(2020, 1, 1)}
+                for id in (new_ids[0], existing_id, new_ids[1])]
+
+        with self.app.app_context():
+            # the duplicate id fails the executemany of the chunk
+            created, errors = bulk_insert(Auto, rows, lambda row: row)
+            inserted = [auto.id for auto in
+                        Auto.query.filter(Auto.id.in_(new_ids))]
+
+        self.assertEqual(created, 2)
+        self.assertEqual([error['index'] for error in errors], [1])
+        self.assertEqual(sorted(inserted), new_ids)
+
     def test_create_buyers(self):
         header_obj = {
             "Authorization": self.auth_headers["Casting Director"]
         }
-        res = self.client().post(f'/buyers',
-                                 json=self.buyer, headers=header_obj)
+        with self.count_queries() as statements:
+            res = self.client().post(f'/buyers',
+                                     json=self.buyer, headers=header_obj)
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['success'])
+        # the committed buyer is not read back
+        self.assertFalse([statement for statement in statements
+                          if statement.startswith('SELECT')
+                          and 'FROM buyers' in statement])
 
     def test_create_buyers_fail_400(self):
         header_obj = {
@@ -262,6 +1122,72 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 403)
         self.assertFalse(data['success'])
 
+    def test_delete_auto_nulls_buyers(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        auto_id = self.insert_autos(1, buyers_per_auto=50)[0]
+        with self.app.app_context():
+            buyer_ids = [buyer.id for buyer in
+                         Buyer.query.filter_by(auto_id=auto_id)]
+
+        with self.count_queries() as statements:
+            res = self.client().delete(f'/autos/{auto_id}',
+                                       headers=header_obj)
+
+        self.assertEqual(res.status_code, 200)
+        # the buyers are left to the database
+        self.assertFalse([statement for statement in statements
+                          if 'FROM buyers' in statement or
+                          statement.startswith('UPDATE buyers')])
+        with self.app.app_context():
+            auto_ids = {buyer.auto_id for buyer in
+                        Buyer.query.filter(Buyer.id.in_(buyer_ids))}
+        self.assertEqual(auto_ids, {None})
+
+    def test_delete_auto_fail_422(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        auto_id = self.insert_autos(1, buyers_per_auto=1)[0]
+        # a foreign key without ON DELETE rejects the delete
+        error = IntegrityError('DELETE FROM autos', {}, Exception())
+        with mock.patch('flaskr.delete_returning', side_effect=error):
+            for path in (f'/autos/{auto_id}', f'/autos?ids={auto_id}'):
+                res = self.client().delete(path, headers=header_obj)
+                data = json.loads(res.data)
+
+                self.assertEqual(res.status_code, 422)
+                self.assertFalse(data['success'])
+
+    def test_delete_autos_by_ids(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        auto_ids = self.insert_autos(3)
+        res = self.client().delete(
+            '/autos?ids=%d,%d,100000' % (auto_ids[0], auto_ids[2]),
+            headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], [auto_ids[0], auto_ids[2]])
+        with self.app.app_context():
+            remaining = [auto.id for auto in
+                         Auto.query.filter(Auto.id.in_(auto_ids))]
+        self.assertEqual(remaining, [auto_ids[1]])
+
+    def test_delete_autos_by_ids_fail_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        for path in ('/autos', '/autos?ids=', '/autos?ids=a,b'):
+            res = self.client().delete(path, headers=header_obj)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertFalse(data['success'])
+
     def test_update_auto(self):
         header_obj = {
             "Authorization": self.auth_headers["Casting Director"]
@@ -358,6 +1284,57 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 403)
         self.assertFalse(data['success'])
 
+    def test_update_auto_supplied_fields(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        auto_id = self.insert_autos(1)[0]
+
+        with self.count_queries() as statements:
+            res = self.client().patch(f'/autos/{auto_id}',
+                                      json={'release_date': '2021-03-04'},
+                                      headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated']['name'], 'Seeded auto 0')
+        self.assertIn('04 Mar 2021', data['updated']['release_date'])
+        # no lookup precedes the update
+        self.assertTrue(statements[0].startswith('UPDATE autos'))
+
+    def test_update_auto_fail_400(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        auto_id = self.insert_autos(1)[0]
+        res = self.client().patch(f'/autos/{auto_id}',
+                                  json={'release_date': 'yesterday'},
+                                  headers=header_obj)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_update_buyer_auto(self):
+        header_obj = {
+            "Authorization": self.auth_headers["Executive Producer"]
+        }
+        first, second = self.insert_autos(2)
+        buyer_id = self.insert_buyers(first, [('Moving buyer', 30, 'F')])[0]
+
+        with mock.patch.object(row_cache, 'ttl', 60):
+            self.client().get(f'/autos/{first}', headers=header_obj)
+            res = self.client().patch(f'/buyers/{buyer_id}',
+                                      json={'auto_id': second},
+                                      headers=header_obj)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['updated']['auto_id'], second)
+            self.assertEqual(data['updated']['name'], 'Moving buyer')
+
+            res = self.client().get(f'/autos/{first}', headers=header_obj)
+            self.assertEqual(json.loads(res.data)['auto']['buyers'], [])
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import unittest
+
+from sqlalchemy import select
+
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'capstone')
+
+from auth.auth import use_jwks  # noqa: E402
+from auth.testing import LocalIssuer  # noqa: E402
+from flaskr import create_app  # noqa: E402
+from flaskr.asgi import (AsyncpgDatabase, create_asgi_app,  # noqa: E402
+                         database_from_url)
+from models import Auto, Buyer, db, setup_db  # noqa: E402
+
+
+class AsyncAppTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer()
+
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client
+        self.database_path = os.environ.get(
+            'TEST_DATABASE_URL', "postgres:///capstone_test")
+        setup_db(self.app, self.database_path)
+        with self.app.app_context():
+            db.create_all()
+
+        self.database = database_from_url(self.database_path)
+        self.asgi = create_asgi_app(self.app, self.database)
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.database.connect())
+
+        use_jwks(self.issuer.jwks())
+        self.headers = {"Authorization": self.issuer.auth_header(
+            ['view:autos', 'view:buyers'])}
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.database.close())
+        self.loop.close()
+
+    async def call(self, method, path, headers=None, body=b''):
+        """Sends one request to the ASGI app, returns the sent messages"""
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'root_path': '',
+            'query_string': query.encode('latin-1'),
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in (headers or {}).items()],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000)
+        }
+        requests = [{'type': 'http.request', 'body': body}]
+        messages = []
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.asgi(scope, receive, send)
+        return messages
+
+    def request(self, method, path, headers=None, body=b''):
+        messages = self.loop.run_until_complete(
+            self.call(method, path, headers, body))
+        headers = {name.decode('latin-1'): value.decode('latin-1')
+                   for name, value in messages[0]['headers']}
+        body = b''.join(message.get('body', b'')
+                        for message in messages[1:])
+        return messages[0]['status'], headers, body
+
+    def test_get_autos_matches_sync_app(self):
+        for path in ('/autos', '/autos?fields=name&sort=-release_date',
+                     '/buyers?limit=2&sort=age'):
+            status, headers, body = self.request('GET', path, self.headers)
+            res = self.client().get(path, headers=self.headers)
+
+            self.assertEqual(status, 200)
+            self.assertEqual(body, res.data)
+            self.assertEqual(headers['etag'], res.headers['ETag'])
+            self.assertIn('db;dur=', headers['server-timing'])
+
+    def test_get_autos_not_modified(self):
+        status, headers, body = self.request('GET', '/autos', self.headers)
+        status, headers, body = self.request('GET', '/autos', dict(
+            self.headers, **{'If-None-Match': headers['etag']}))
+
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+
+    def test_errors_are_json(self):
+        for path, headers, expected in (
+                ('/buyers', {}, 401),
+                ('/buyers?age_min=old', self.headers, 400),
+                ('/autos?after=not-a-cursor', self.headers, 400)):
+            status, _, body = self.request('GET', path, headers)
+            data = json.loads(body)
+
+            self.assertEqual(status, expected)
+            self.assertFalse(data['success'])
+            self.assertEqual(data['error'], expected)
+
+    def test_other_routes_are_served_by_flask(self):
+        status, headers, body = self.request('GET', '/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn(b'db_pool_size', body)
+
+        messages = self.loop.run_until_complete(
+            self.call('GET', '/autos/export', self.headers))
+        lines = b''.join(message.get('body', b'')
+                         for message in messages[1:]).splitlines()
+        with self.app.app_context():
+            count = Auto.query.count()
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(len(lines), count)
+        self.assertFalse(messages[-1].get('more_body', False))
+
+    def test_concurrent_requests_keep_their_context(self):
+        paths = ['/buyers?limit=%d' % (i % 3 + 1) for i in range(30)]
+
+        async def call_all():
+            return await asyncio.gather(*[
+                self.call('GET', path, self.headers) for path in paths])
+
+        responses = self.loop.run_until_complete(call_all())
+        for path, messages in zip(paths, responses):
+            data = json.loads(b''.join(
+                message.get('body', b'') for message in messages[1:]))
+
+            self.assertEqual(messages[0]['status'], 200)
+            self.assertEqual(len(data['buyers']), int(path[-1]))
+
+    def test_asyncpg_statements(self):
+        database = AsyncpgDatabase('postgresql+psycopg2://u:p@localhost/db')
+        table = Buyer.__table__
+        sql, parameters = database.compile(
+            select([table.c.id])
+            .where(table.c.name.like('50\\%%', escape='\\'))
+            .where(table.c.auto_id.in_([1, 2]))
+            .limit(10))
+
+        self.assertEqual(database.dsn, 'postgresql://u:p@localhost/db')
+        self.assertIn("LIKE $1 ESCAPE '\\'", sql)
+        self.assertIn('IN ($2, $3)', sql)
+        self.assertIn('LIMIT $4', sql)
+        self.assertEqual(parameters, ['50\\%%', 1, 2, 10])
+
+
+if __name__ == "__main__":
+    unittest.main()
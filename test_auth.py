@@ -0,0 +1,282 @@
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'capstone')
+
+from auth.auth import (AuthError, JWKSKeyStore,  # noqa: E402
+                       VerifiedTokenCache, jwks_store, requires_auth,
+                       token_cache, use_jwks, verify_decode_jwt)
+from auth.testing import JWKSServer, LocalIssuer  # noqa: E402
+
+
+def make_jwks(*kids):
+    return {
+        'keys': [
+            {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n', 'e': 'AQAB'}
+            for kid in kids
+        ]
+    }
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        fd, self.jwks_path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.write_jwks('key-1')
+        self.store = JWKSKeyStore(
+            'file://' + self.jwks_path,
+            ttl=60,
+            min_refresh_interval=10,
+            clock=self.clock)
+
+    def tearDown(self):
+        if os.path.exists(self.jwks_path):
+            os.remove(self.jwks_path)
+
+    def write_jwks(self, *kids):
+        with open(self.jwks_path, 'w') as f:
+            json.dump(make_jwks(*kids), f)
+
+    def test_keys_are_served_from_memory_within_ttl(self):
+        for _ in range(5):
+            self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+            self.clock.now += 5
+
+        self.assertEqual(self.store.fetch_count, 1)
+
+    def test_keys_are_refetched_after_ttl(self):
+        self.store.get_key('key-1')
+        self.clock.now += 61
+        self.store.get_key('key-1')
+
+        self.assertEqual(self.store.fetch_count, 2)
+
+    def test_unknown_kid_triggers_refetch(self):
+        self.store.get_key('key-1')
+        self.write_jwks('key-1', 'key-2')
+        self.clock.now += 11
+
+        self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(self.store.fetch_count, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.get_key('key-1')
+        for _ in range(5):
+            self.assertIsNone(self.store.get_key('unknown'))
+
+        self.assertEqual(self.store.fetch_count, 1)
+
+    def test_stale_keys_are_served_when_refresh_fails(self):
+        self.store.get_key('key-1')
+        os.remove(self.jwks_path)
+        self.clock.now += 61
+
+        self.assertEqual(self.store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(self.store.fetch_count, 2)
+
+    def test_fetch_failure_without_keys_raises_auth_error(self):
+        os.remove(self.jwks_path)
+
+        with self.assertRaises(AuthError) as context:
+            self.store.get_key('key-1')
+        self.assertEqual(context.exception.status_code, 503)
+
+    def test_concurrent_refreshes_are_collapsed(self):
+        server = JWKSServer(make_jwks('key-1'), delay=0.2)
+        self.addCleanup(server.close)
+
+        store = JWKSKeyStore(server.url)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(store.get_key('key-1')))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(server.request_count, 1)
+        self.assertTrue(all(key['kid'] == 'key-1' for key in results))
+
+    def test_in_memory_sources(self):
+        store = JWKSKeyStore(make_jwks('key-1'))
+        self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+
+        store = JWKSKeyStore(lambda: make_jwks('key-2'))
+        self.assertEqual(store.get_key('key-2')['kid'], 'key-2')
+
+    def test_configure_drops_the_previous_keys(self):
+        self.store.get_key('key-1')
+        self.store.configure(make_jwks('key-2'))
+
+        self.assertIsNone(self.store.get_key('key-1'))
+        self.assertEqual(self.store.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(self.store.fetch_count, 2)
+
+
+class LocalIssuerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer()
+
+    def setUp(self):
+        self.addCleanup(use_jwks, jwks_store.source)
+        self.server = self.issuer.serve()
+        self.addCleanup(self.server.close)
+        use_jwks(self.server.url)
+
+    def assertAuthError(self, token, status_code, code):
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(token)
+        self.assertEqual(context.exception.status_code, status_code)
+        self.assertEqual(context.exception.error['code'], code)
+
+    def test_tokens_are_verified_against_the_local_jwks(self):
+        payload = verify_decode_jwt(self.issuer.token(['view:autos']))
+
+        self.assertEqual(payload['permissions'], ['view:autos'])
+        self.assertEqual(self.server.request_count, 1)
+
+    def test_expired_token(self):
+        self.assertAuthError(
+            self.issuer.token(expires_in=-60), 401, 'token_expired')
+
+    def test_wrong_audience(self):
+        self.assertAuthError(
+            self.issuer.token(aud='other'), 401, 'invalid_claims')
+
+    def test_token_of_an_unknown_key(self):
+        self.assertAuthError(
+            LocalIssuer().token(), 400, 'invalid_header')
+
+    def test_requires_auth_checks_the_permissions(self):
+        app = Flask(__name__)
+
+        @app.route('/protected')
+        @requires_auth('delete:autos')
+        def protected(payload):
+            return payload['sub']
+
+        app.register_error_handler(
+            AuthError, lambda error: ('', error.status_code))
+        for permissions, expected in ((['view:autos'], 403),
+                                      (['delete:autos'], 200)):
+            res = app.test_client().get('/protected', headers={
+                'Authorization': self.issuer.auth_header(permissions)})
+            self.assertEqual(res.status_code, expected)
+
+    def test_written_jwks(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        use_jwks(self.issuer.write_jwks(path))
+
+        self.assertIn('sub', verify_decode_jwt(self.issuer.token()))
+
+    @unittest.skipUnless(importlib.util.find_spec('Crypto'),
+                         'pycryptodome is not installed')
+    def test_keys_from_pycryptodome(self):
+        # the pinned python-jose-cryptodome brings an old pycryptodome only
+        with mock.patch.dict(sys.modules, dict.fromkeys((
+                'cryptography', 'cryptography.hazmat.primitives',
+                'cryptography.hazmat.primitives.asymmetric'))):
+            issuer = LocalIssuer()
+        use_jwks(issuer.jwks())
+
+        self.assertIn('sub', verify_decode_jwt(issuer.token()))
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = VerifiedTokenCache(maxsize=2, clock=self.clock)
+
+    def test_hit_and_miss_are_counted(self):
+        payload = {'sub': 'user', 'exp': self.clock.now + 60}
+
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.put('token', payload)
+        self.assertIs(self.cache.get('token'), payload)
+
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_entry_expires_at_exp_claim(self):
+        self.cache.put('token', {'exp': self.clock.now + 60})
+        self.clock.now += 60
+
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_token_without_exp_is_not_cached(self):
+        self.cache.put('token', {'sub': 'user'})
+
+        self.assertIsNone(self.cache.get('token'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        exp = self.clock.now + 60
+        self.cache.put('first', {'exp': exp})
+        self.cache.put('second', {'exp': exp})
+        self.cache.get('first')
+        self.cache.put('third', {'exp': exp})
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertIsNotNone(self.cache.get('third'))
+
+    def test_requires_auth_verifies_token_once(self):
+        app = Flask(__name__)
+
+        @app.route('/protected')
+        @requires_auth('view:autos')
+        def protected(payload):
+            return payload['sub']
+
+        payload = {
+            'sub': 'user',
+            'exp': time.time() + 60,
+            'permissions': ['view:autos']
+        }
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        headers = {'Authorization': 'Bearer cached-token'}
+        with mock.patch('auth.auth.verify_decode_jwt',
+                        return_value=payload) as verify:
+            for _ in range(3):
+                res = app.test_client().get('/protected', headers=headers)
+                self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(token_cache.hits, 2)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import gzip
+import unittest
+import zlib
+
+from flask import Flask, Response, jsonify
+
+from flaskr.compression import GzipEncoder, compress_chunks, init_compression
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def create_test_app():
+    app = Flask(__name__)
+    init_compression(app)
+
+    @app.route('/large')
+    def large():
+        response = jsonify({'items': ['repetitive item'] * 500})
+        response.set_etag('abc')
+        return response
+
+    @app.route('/small')
+    def small():
+        return jsonify({'items': []})
+
+    @app.route('/html')
+    def html():
+        return '<p>' + 'text ' * 1000 + '</p>'
+
+    @app.route('/stream')
+    def stream():
+        def lines():
+            for i in range(3):
+                yield '{"line": %d}\n' % i
+        return Response(lines(), mimetype='application/x-ndjson')
+
+    return app
+
+
+class CompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = create_test_app().test_client()
+
+    def test_gzip_is_negotiated(self):
+        res = self.client.get('/large', headers={
+            'Accept-Encoding': 'gzip, deflate'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(res.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(res.headers['Content-Length']), len(res.data))
+        self.assertIn(b'repetitive item', gzip.decompress(res.data))
+        self.assertEqual(res.headers['ETag'], 'W/"abc"')
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        res = self.client.get('/large', headers={
+            'Accept-Encoding': 'gzip, br'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertIn(b'repetitive item', brotli.decompress(res.data))
+
+        res = self.client.get('/large', headers={
+            'Accept-Encoding': 'gzip, br;q=0'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+
+    def test_identity_is_kept(self):
+        for path, accept_encoding in (('/large', ''),
+                                      ('/large', 'gzip;q=0'),
+                                      ('/small', 'gzip'),
+                                      ('/html', 'gzip')):
+            res = self.client.get(path, headers={
+                'Accept-Encoding': accept_encoding})
+
+            self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_streamed_response_is_compressed(self):
+        res = self.client.get('/stream', headers={
+            'Accept-Encoding': 'gzip'})
+
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', res.headers)
+        self.assertEqual(gzip.decompress(res.data),
+                         b'{"line": 0}\n{"line": 1}\n{"line": 2}\n')
+
+    def test_every_chunk_is_flushed(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = compress_chunks(iter([b'first\n', b'second\n']),
+                                 GzipEncoder())
+
+        self.assertEqual(decompressor.decompress(next(chunks)), b'first\n')
+        self.assertEqual(decompressor.decompress(next(chunks)), b'second\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import runpy
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from flask import Flask
+from gunicorn.app.base import Application
+from gunicorn.config import Config
+
+from models import db, dispose_engines, setup_db
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'gunicorn.conf.py')
+
+
+def load_config(**environ):
+    with mock.patch.dict(os.environ, environ):
+        return runpy.run_path(CONFIG_PATH)
+
+
+class ConfigFileApplication(Application):
+    """Reads gunicorn.conf.py the way gunicorn does, ignores sys.argv"""
+
+    def load_config(self):
+        self.load_config_from_file(CONFIG_PATH)
+
+    def load(self):
+        return None
+
+
+class GunicornConfigTestCase(unittest.TestCase):
+
+    def test_defaults_are_sized_from_cpus(self):
+        with mock.patch.dict(os.environ):
+            for name in ('WEB_CONCURRENCY', 'GUNICORN_THREADS', 'PORT',
+                         'DB_POOL_SIZE', 'DB_MAX_OVERFLOW',
+                         'DB_MAX_CONNECTIONS'):
+                os.environ.pop(name, None)
+            config = runpy.run_path(CONFIG_PATH)
+
+        cpus = config['cpus']
+        self.assertEqual(config['workers'], min(2 * cpus + 1, 90 // 15))
+        self.assertEqual(config['threads'], min(2 * cpus, 15))
+        self.assertEqual(config['bind'], '0.0.0.0:8000')
+        self.assertTrue(config['preload_app'])
+        self.assertGreater(config['max_requests'], 0)
+        self.assertGreater(config['max_requests_jitter'], 0)
+
+    def test_settings_are_read_from_the_environment(self):
+        config = load_config(
+            WEB_CONCURRENCY='3', GUNICORN_THREADS='7', PORT='5000',
+            GUNICORN_PRELOAD='false', GUNICORN_MAX_REQUESTS='50',
+            GUNICORN_MAX_REQUESTS_JITTER='5', GUNICORN_KEEPALIVE='2',
+            GUNICORN_WORKER_CLASS='sync')
+
+        self.assertEqual(config['workers'], 3)
+        self.assertEqual(config['threads'], 7)
+        self.assertEqual(config['bind'], '0.0.0.0:5000')
+        self.assertFalse(config['preload_app'])
+        self.assertEqual(config['max_requests'], 50)
+        self.assertEqual(config['max_requests_jitter'], 5)
+        self.assertEqual(config['keepalive'], 2)
+        self.assertEqual(config['worker_class'], 'sync')
+
+    def test_threads_are_capped_by_the_pool(self):
+        config = load_config(DB_POOL_SIZE='1', DB_MAX_OVERFLOW='0')
+
+        self.assertEqual(config['threads'], 1)
+
+    def test_workers_stay_within_the_connection_budget(self):
+        with mock.patch('os.sched_getaffinity', return_value=range(16)):
+            config = load_config(DB_MAX_CONNECTIONS='100', DB_POOL_SIZE='5',
+                                 DB_MAX_OVERFLOW='5')
+        self.assertEqual(config['workers'], 10)
+
+        with self.assertRaises(RuntimeError):
+            load_config(DB_MAX_CONNECTIONS='100', WEB_CONCURRENCY='7')
+        # not even a single worker fits
+        with self.assertRaises(RuntimeError):
+            load_config(DB_MAX_CONNECTIONS='10', DB_POOL_SIZE='20')
+
+    def test_only_gunicorn_settings_are_applied(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '3'}):
+            cfg = ConfigFileApplication().cfg
+
+        self.assertEqual(cfg.workers, 3)
+        # the connection budget must not cap the clients of a worker
+        self.assertEqual(cfg.worker_connections,
+                         Config().worker_connections)
+
+    def test_post_fork_disposes_the_preloaded_engines(self):
+        config = load_config()
+        app = Flask(__name__)
+        server = SimpleNamespace(
+            cfg=SimpleNamespace(preload_app=True),
+            app=SimpleNamespace(wsgi=lambda: app))
+
+        with mock.patch('models.dispose_engines') as dispose:
+            config['post_fork'](server, worker=None)
+            dispose.assert_called_once_with(app)
+
+            server.cfg.preload_app = False
+            config['post_fork'](server, worker=None)
+            dispose.assert_called_once_with(app)
+
+    def test_dispose_engines(self):
+        app = Flask(__name__)
+        setup_db(app, 'sqlite://')
+        with app.app_context():
+            engine = db.get_engine(app)
+
+        with mock.patch.object(engine, 'dispose') as dispose:
+            dispose_engines(app)
+            dispose.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
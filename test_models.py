@@ -0,0 +1,191 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from datetime import datetime
+
+from flask import Flask
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.dialects import postgresql
+
+from models import (Auto, InstrumentedQueuePool, TableVersion, bump_versions,
+                    db, engine_options, pool_metrics, setup_db, unit_of_work,
+                    update_returning)
+
+
+class PoolMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.database_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = create_engine(
+            'sqlite:///' + self.database_file,
+            poolclass=InstrumentedQueuePool,
+            pool_logging_name='metrics_test',
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05)
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.database_file)
+
+    def test_checkouts_and_timeouts_are_reported(self):
+        connection = self.engine.connect()
+        with self.assertRaises(exc.TimeoutError):
+            self.engine.connect()
+        metrics = pool_metrics.render()
+        connection.close()
+
+        self.assertIn('db_pool_size{pool="metrics_test"} 1', metrics)
+        self.assertIn('db_pool_checked_out{pool="metrics_test"} 1', metrics)
+        self.assertIn('db_pool_overflow{pool="metrics_test"} 0', metrics)
+        self.assertIn(
+            'db_pool_checkout_wait_seconds_count{pool="metrics_test"} 2',
+            metrics)
+        self.assertIn(
+            'db_pool_checkout_timeouts_total{pool="metrics_test"} 1',
+            metrics)
+
+    def test_engine_options_are_read_from_environment(self):
+        environ = {
+            'DB_POOL_SIZE': '8',
+            'DB_MAX_OVERFLOW': '4',
+            'DB_POOL_TIMEOUT': '2.5',
+            'DB_POOL_RECYCLE': '600',
+            'DB_POOL_PRE_PING': 'false'
+        }
+        with mock.patch.dict(os.environ, environ):
+            options = engine_options('postgresql://localhost/capstone')
+
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 8)
+        self.assertEqual(options['max_overflow'], 4)
+        self.assertEqual(options['pool_timeout'], 2.5)
+        self.assertEqual(options['pool_recycle'], 600)
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertEqual(engine_options('sqlite:///capstone.db'), {})
+
+
+class ModelTestCase(unittest.TestCase):
+    """An app on a temporary SQLite database with one auto"""
+
+    def setUp(self):
+        fd, self.database_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + self.database_file)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(Auto(name='Eyvah eyvah',
+                            release_date=datetime(2010, 1, 1)))
+        db.session.commit()
+        self.statements = []
+        self.commits = 0
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+        event.listen(db.engine, 'commit', self.record_commit)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.record)
+        event.remove(db.engine, 'commit', self.record_commit)
+        db.session.remove()
+        db.engine.dispose()
+        self.context.pop()
+        os.remove(self.database_file)
+
+    def record(self, conn, cursor, statement, *args):
+        self.statements.append(statement.split()[0])
+
+    def record_commit(self, conn):
+        self.commits += 1
+
+    def auto_names(self):
+        return [auto.name for auto in Auto.query.order_by(Auto.id)]
+
+
+class UpdateReturningTestCase(ModelTestCase):
+
+    def test_only_the_given_fields_are_updated(self):
+        version = TableVersion.current('autos')['autos'][0]
+        del self.statements[:]
+        row = update_returning(Auto, 1, {'name': 'Eyvah eyvah 2'})
+        db.session.commit()
+
+        self.assertEqual(dict(row), {
+            'id': 1,
+            'name': 'Eyvah eyvah 2',
+            'release_date': datetime(2010, 1, 1)
+        })
+        self.assertEqual(self.statements[0], 'UPDATE')
+        self.assertEqual(
+            TableVersion.current('autos')['autos'][0], version + 1)
+
+    def test_missing_rows_are_not_looked_up(self):
+        version = TableVersion.current('autos')['autos'][0]
+        del self.statements[:]
+
+        self.assertIsNone(update_returning(Auto, 100, {'name': 'x'}))
+        self.assertEqual(self.statements, ['UPDATE'])
+        db.session.commit()
+        self.assertEqual(TableVersion.current('autos')['autos'][0], version)
+
+    def test_no_fields_reads_the_row(self):
+        row = update_returning(Auto, 1, {})
+
+        self.assertEqual(row['name'], 'Eyvah eyvah')
+        self.assertEqual(self.statements, ['SELECT'])
+
+
+class UnitOfWorkTestCase(ModelTestCase):
+
+    def test_methods_commit_outside_a_unit(self):
+        Auto(name='Single', release_date=datetime(2011, 1, 1)).insert()
+
+        self.assertEqual(self.commits, 1)
+        db.session.rollback()
+        self.assertEqual(self.auto_names(), ['Eyvah eyvah', 'Single'])
+
+    def test_writes_are_committed_once(self):
+        with unit_of_work():
+            for name in ('First', 'Second'):
+                Auto(name=name, release_date=datetime(2011, 1, 1)).insert()
+            with unit_of_work():
+                Auto.query.get(1).delete()
+            self.assertEqual(self.commits, 0)
+
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(self.auto_names(), ['First', 'Second'])
+
+    def test_errors_roll_back(self):
+        with self.assertRaises(ZeroDivisionError):
+            with unit_of_work():
+                Auto(name='Lost', release_date=datetime(2011, 1, 1)).insert()
+                update_returning(Auto, 1, {'name': 'Lost too'})
+                1 / 0
+
+        self.assertEqual(self.commits, 0)
+        self.assertEqual(self.auto_names(), ['Eyvah eyvah'])
+        self.assertEqual(db.session.info['unit_of_work_depth'], 0)
+
+
+class BumpVersionsTestCase(unittest.TestCase):
+
+    def test_postgres_bumps_with_one_upsert_per_table(self):
+        connection = mock.Mock()
+        connection.dialect = postgresql.dialect()
+
+        bump_versions(connection, {'buyers', 'autos'})
+
+        statements = [str(call.args[0].compile(dialect=connection.dialect))
+                      for call in connection.execute.call_args_list]
+        self.assertEqual(len(statements), 2)
+        for statement in statements:
+            # concurrent first writes to a table must not both insert
+            self.assertIn('ON CONFLICT (name) DO UPDATE', statement)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+os.environ.setdefault('AUTH0_DOMAIN', 'capstone.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'capstone')
+
+from auth.auth import use_jwks  # noqa: E402
+from auth.testing import LocalIssuer  # noqa: E402
+from flaskr import create_app  # noqa: E402
+from flaskr.caching import response_cache  # noqa: E402
+from flaskr.replicas import replica_router  # noqa: E402
+from models import Auto, db, dispose_engines, setup_db  # noqa: E402
+
+DATABASES = ('primary', 'replica_0', 'replica_1')
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """A primary and two replicas on SQLite, each with its own auto 1"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer()
+        cls.reader = {"Authorization": cls.issuer.auth_header(
+            ['view:autos', 'view:buyers'])}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        paths = ['sqlite:///' + os.path.join(directory.name, name + '.db')
+                 for name in DATABASES]
+        for path, name in zip(paths, DATABASES):
+            engine = create_engine(path)
+            db.metadata.create_all(engine)
+            engine.execute(Auto.__table__.insert(), id=1, name=name,
+                           release_date=datetime(2020, 1, 1))
+            engine.dispose()
+        self.paths = dict(zip(DATABASES, paths))
+
+        self.app = create_app()
+        setup_db(self.app, paths[0], paths[1:])
+        self.addCleanup(dispose_engines, self.app)
+        self.client = self.app.test_client
+
+        # every response is read from the database
+        patcher = mock.patch.object(response_cache, 'ttl', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        use_jwks(self.issuer.jwks())
+        # a client of its own, not sticky yet
+        self.writer = {"Authorization": self.issuer.auth_header(
+            ['view:autos', 'update:autos'])}
+
+    def auto_name(self, headers, path='/autos'):
+        res = self.client().get(path, headers=headers)
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        return data['auto']['name'] if 'auto' in data else \
+            data['autos'][0]['name']
+
+    def stored_name(self, database):
+        engine = create_engine(self.paths[database])
+        try:
+            return engine.execute(
+                Auto.__table__.select().where(Auto.id == 1)).first().name
+        finally:
+            engine.dispose()
+
+    def patch_auto(self, name):
+        res = self.client().patch('/autos/1', json={'name': name},
+                                  headers=self.writer)
+        self.assertEqual(res.status_code, 200)
+
+    def test_reads_go_to_the_replicas_in_turn(self):
+        names = [self.auto_name(self.reader) for _ in range(2)]
+        self.assertEqual(sorted(names), ['replica_0', 'replica_1'])
+
+        names = [self.auto_name(self.reader, '/autos/1') for _ in range(2)]
+        self.assertEqual(sorted(names), ['replica_0', 'replica_1'])
+
+    def test_writes_go_to_the_primary(self):
+        self.patch_auto('patched')
+
+        self.assertEqual(self.stored_name('primary'), 'patched')
+        self.assertEqual(self.stored_name('replica_0'), 'replica_0')
+        self.assertEqual(self.stored_name('replica_1'), 'replica_1')
+
+    def test_writers_read_their_writes(self):
+        self.patch_auto('patched')
+
+        self.assertEqual(self.auto_name(self.writer), 'patched')
+        self.assertEqual(self.auto_name(self.writer, '/autos/1'), 'patched')
+        # other clients keep reading from the replicas
+        self.assertTrue(self.auto_name(self.reader).startswith('replica'))
+
+    def test_stickiness_can_be_disabled(self):
+        with mock.patch.object(replica_router, 'sticky_seconds', 0):
+            self.patch_auto('patched')
+
+            self.assertTrue(
+                self.auto_name(self.writer).startswith('replica'))
+
+    def test_without_replicas_reads_use_the_primary(self):
+        setup_db(self.app, self.paths['primary'], [])
+
+        self.assertEqual(self.auto_name(self.reader), 'primary')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
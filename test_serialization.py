@@ -0,0 +1,109 @@
+import json
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from flask import Flask, jsonify
+
+from flaskr.serialization import (OrjsonJSONProvider, StdlibJSONProvider,
+                                  json_list_response, json_response,
+                                  provider_from_name)
+from flaskr.serializers import row_serializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DOCUMENT = {
+    'success': True,
+    'next_cursor': None,
+    'release_date': datetime(2012, 5, 4),
+    'aware': datetime(2012, 5, 4, 2, tzinfo=timezone(timedelta(hours=2))),
+    'id': uuid.UUID(int=1),
+    'nested': [{'b': 1, 'a': [1.5, 'x']}],
+    'name': 'Pek Yakında \U0001f697'
+}
+
+
+class JSONProviderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.context = self.app.app_context()
+        self.context.push()
+        self.providers = [StdlibJSONProvider()]
+        if orjson is not None:
+            self.providers.append(OrjsonJSONProvider())
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_stdlib_matches_flask_jsonify(self):
+        expected = jsonify(DOCUMENT).get_data()
+        response = json_response(DOCUMENT, provider=StdlibJSONProvider())
+
+        self.assertEqual(response.get_data(), expected)
+        self.assertEqual(response.mimetype, 'application/json')
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_matches_stdlib(self):
+        document = dict(DOCUMENT, name='Yahşi Batı')
+        stdlib = json_response(document, provider=StdlibJSONProvider())
+        fast = json_response(document, provider=OrjsonJSONProvider())
+
+        self.assertEqual(fast.get_data(), stdlib.get_data())
+        self.assertEqual(json.loads(fast.get_data())['release_date'],
+                         'Fri, 04 May 2012 00:00:00 GMT')
+        self.assertEqual(json.loads(fast.get_data())['aware'],
+                         'Fri, 04 May 2012 00:00:00 GMT')
+
+    def test_list_response_matches_materialized_list(self):
+        rows = [(3, datetime(2020, 1, 1)), (1, None)]
+
+        def format_row(row):
+            return {'id': row[0], 'release_date': row[1]}
+
+        for provider in self.providers:
+            expected = json_response({
+                'success': True,
+                'autos': [format_row(row) for row in rows],
+                'next_cursor': 'abc'
+            }, provider=provider).get_data()
+            response = json_list_response(
+                {'success': True, 'next_cursor': 'abc'}, 'autos', rows,
+                format_row, provider=provider)
+
+            self.assertEqual(response.get_data(), expected)
+
+    def test_row_serializer(self):
+        serialize = row_serializer(('id', 'name'))
+
+        # trailing values, e.g. the sort key of a page, are left out
+        self.assertEqual(serialize((1, 'Audi', 'cursor')),
+                         {'id': 1, 'name': 'Audi'})
+        self.assertIs(row_serializer(['id', 'name']), serialize)
+        self.assertEqual(row_serializer(('id',))((7,)), {'id': 7})
+
+    def test_unserializable_value_raises(self):
+        for provider in self.providers:
+            with self.assertRaises(TypeError):
+                provider.dumps({'value': object()})
+
+    def test_provider_from_name(self):
+        self.assertIsInstance(provider_from_name('stdlib'),
+                              StdlibJSONProvider)
+        with self.assertRaises(ValueError):
+            provider_from_name('simplejson')
+
+        # auto falls back to the standard library without orjson
+        with mock.patch.dict('sys.modules', {'orjson': None}):
+            self.assertIsInstance(provider_from_name('auto'),
+                                  StdlibJSONProvider)
+            with self.assertRaises(ImportError):
+                provider_from_name('orjson')
+
+
+if __name__ == "__main__":
+    unittest.main()